@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+# Per-record cost of the event dispatch against the number of sinks, for the
+# flat handler lists of EventSource.addSink and for the nested closures it used
+# to build. Sinks do nothing, so only the dispatch is measured. The two are
+# timed alternately and the best of several runs is kept, so drift of the
+# machine hits both alike.
+#
+# to_csv sends records to one after_send (the profiler) and headers to one
+# before_header (the progress reporter). The explorer's header events go to
+# two before_header handlers (IndexMapper and its progress updater), and
+# BinSummarizer, TestSummarizer, PartSummarizer and ParametricSummarizer add
+# one sink each.
+#
+#   python benchmarks/dispatch_overhead.py [records] [runs]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pystdf.V4 as V4
+from pystdf.Pipeline import DataSource, appendPrefixAction, appendSuffixAction
+
+
+class AfterSink:
+    def after_send(self, dataSource, data):
+        pass
+
+
+class BeforeSink:
+    def before_send(self, dataSource, data):
+        pass
+
+
+class BeforeAfterSink:
+    def before_send(self, dataSource, data):
+        pass
+
+    def after_send(self, dataSource, data):
+        pass
+
+
+def make_sinks(count):
+    # Every other sink also listens before the event, as the explorer's mappers do
+    return [BeforeAfterSink() if i % 2 else AfterSink() for i in range(count)]
+
+
+def flat_source(sinks):
+    source = DataSource([])
+    for sink in sinks:
+        source.addSink(sink)
+    return source
+
+
+def nested_source(sinks):
+    # What addSink did before: one more closure around send for every handler
+    source = DataSource([])
+    for sink in sinks:
+        if hasattr(sink, 'before_send'):
+            source.send = appendPrefixAction(source.send, source, sink.before_send)
+        if hasattr(sink, 'after_send'):
+            source.send = appendSuffixAction(source.send, source, sink.after_send)
+    return source
+
+
+def run(source, records):
+    send = source.send
+    data = (V4.ptr, [None] * len(V4.ptr.fieldNames))
+    start = time.perf_counter()
+    for _ in range(records):
+        send(data)
+    return time.perf_counter() - start
+
+
+def cases():
+    yield '1 after', [AfterSink()]
+    yield '1 before', [BeforeSink()]
+    yield '2 before', [BeforeSink(), BeforeSink()]
+    for count in (2, 3, 4, 8, 16):
+        yield '%d' % count, make_sinks(count)
+
+
+if __name__ == '__main__':
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    print('%8s %12s %12s %8s' % ('sinks', 'nested ns', 'flat ns', 'change'))
+    for label, sinks in cases():
+        nested_times = []
+        flat_times = []
+        for _ in range(runs):
+            nested_times.append(run(nested_source(sinks), records))
+            flat_times.append(run(flat_source(sinks), records))
+        nested = min(nested_times) / records * 1e9
+        flat = min(flat_times) / records * 1e9
+        print('%8s %12.1f %12.1f %7.1f%%' % (label, nested, flat, (flat - nested) / nested * 100))
@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+# Check that parsing one STDF file split over worker processes gives the same
+# test matrix as parsing it in one go, both as frames and as to_csv output.
+# Exits with status 1 on the first difference.
+#
+#   python benchmarks/parallel_check.py file.stdf [workers ...]
+import filecmp
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from script.file_read import FileReaders, MyTestResultProfiler
+
+
+def rendered(filename, workers):
+    frame, flags = FileReaders.profile_file(filename, None, workers)
+    return MyTestResultProfiler.render_results(frame, flags)
+
+
+def csv_file(filename, workers, directory):
+    output = os.path.join(directory, 'workers_%d' % workers)
+    FileReaders.to_csv([filename], output, None, workers)
+    return output + '.csv'
+
+
+def check(filename, workers_list):
+    serial = rendered(filename, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        serial_csv = csv_file(filename, 1, directory)
+        for workers in workers_list:
+            frame = rendered(filename, workers)
+            if list(frame.columns) != list(serial.columns):
+                print('workers=%d: columns differ' % workers)
+                return False
+            if not frame.astype(str).equals(serial.astype(str)):
+                rows = (frame.astype(str) != serial.astype(str)).any(axis=1).sum()
+                print('workers=%d: %d of %d rows differ' % (workers, rows, len(serial)))
+                return False
+            if not filecmp.cmp(serial_csv, csv_file(filename, workers, directory), shallow=False):
+                print('workers=%d: csv output differs' % workers)
+                return False
+            print('workers=%d: same as serial, %d rows' % (workers, len(serial)))
+    return True
+
+
+if __name__ == '__main__':
+    workers_list = [int(workers) for workers in sys.argv[2:]] or [2, 3, 4]
+    sys.exit(0 if check(sys.argv[1], workers_list) else 1)
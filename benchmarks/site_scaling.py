@@ -0,0 +1,105 @@
+# -*- coding:utf-8 -*-
+# Time MyTestResultProfiler per record against the number of sites per touchdown,
+# with its SITE_NUM -> slots dict and, for reference, with the linear scan over
+# the sites of the touchdown it did before. Records are fed to after_send
+# directly, so only the profiler is measured.
+#
+#   python benchmarks/site_scaling.py [tests per part] [parts]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pystdf.V4 as V4
+from script.file_read import MyTestResultProfiler
+
+
+class DataSource:
+    # Stands in for the parser, the profiler only reads the record offset
+    recordOffset = 0
+
+
+class LinearSiteSlots:
+    # Stands in for site_slots, finding the slots of a site the way the profiler
+    # used to: comparing it with every site of the touchdown
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def setdefault(self, site, slots):
+        return slots
+
+    def get(self, site, default):
+        sites = self.profiler.test_result_dict['SITE_NUM']
+        return [i for i in range(self.profiler.site_count) if site == sites[i]]
+
+
+class LinearSiteProfiler(MyTestResultProfiler):
+    def __init__(self, *args, **kwargs):
+        MyTestResultProfiler.__init__(self, *args, **kwargs)
+        self.linear_slots = LinearSiteSlots(self)
+
+    @property
+    def site_slots(self):
+        return self.linear_slots
+
+    @site_slots.setter
+    def site_slots(self, value):
+        pass
+
+
+def make_record(rectype, **values):
+    fields = [None] * len(rectype.fieldNames)
+    for name, value in values.items():
+        fields[getattr(rectype, name)] = value
+    return rectype, fields
+
+
+def touchdown_records(sites, tests, touchdown):
+    records = [make_record(V4.pir, HEAD_NUM=1, SITE_NUM=site) for site in range(sites)]
+    for test in range(tests):
+        for site in range(sites):
+            records.append(make_record(V4.ptr, TEST_NUM=test, HEAD_NUM=1, SITE_NUM=site, TEST_FLG=0,
+                                       RESULT=0.5, TEST_TXT='test_%d' % test, HI_LIMIT=1.0,
+                                       LO_LIMIT=0.0, UNITS='V'))
+    for site in range(sites):
+        records.append(make_record(V4.ftr, TEST_NUM=tests, HEAD_NUM=1, SITE_NUM=site, TEST_FLG=0,
+                                   TEST_TXT='functional', VECT_NAM='pattern'))
+    records.append(make_record(V4.eps))
+    for site in range(sites):
+        records.append(make_record(V4.prr, HEAD_NUM=1, SITE_NUM=site, PART_FLG=0, NUM_TEST=tests + 1,
+                                   HARD_BIN=1, SOFT_BIN=1, X_COORD=touchdown, Y_COORD=site, TEST_T=10,
+                                   PART_ID=str(touchdown * sites + site)))
+    return records
+
+
+def run(sites, tests, parts, profiler_class=MyTestResultProfiler):
+    header = [make_record(V4.mir, NODE_NAM='node', START_T=0, JOB_NAM='job', LOT_ID='lot', EXEC_TYP='bench'),
+              make_record(V4.wir, HEAD_NUM=1, WAFER_ID='1'),
+              make_record(V4.bps, SEQ_NAME='seq')]
+    touchdowns = [touchdown_records(sites, tests, touchdown) for touchdown in range(max(1, parts // sites))]
+    count = len(header) + sum(len(records) for records in touchdowns)
+
+    profiler = profiler_class('bench.stdf', None, 1, None, numeric=True)
+    source = DataSource()
+    profiler.after_begin(source)
+    send = profiler.after_send
+    start = time.perf_counter()
+    for data in header:
+        send(source, data)
+    for records in touchdowns:
+        for data in records:
+            send(source, data)
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+
+if __name__ == '__main__':
+    tests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    parts = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    print('%6s %10s %10s %12s %12s' % ('sites', 'records', 'seconds', 'us/record', 'linear us'))
+    for sites in (1, 4, 16, 64, 256):
+        count, elapsed = run(sites, tests, parts)
+        count, linear = run(sites, tests, parts, LinearSiteProfiler)
+        print('%6d %10d %10.3f %12.2f %12.2f' % (sites, count, elapsed, elapsed / count * 1e6,
+                                                 linear / count * 1e6))
@@ -100,22 +100,13 @@ class BinSummarizer(EventSource):
   def before_complete(self, dataSource):
     self.binSummaryReady(dataSource)
   
-  def before_send(self, dataSource, data):
-    table, row = data
-    if table.name == prr.name:
-      self.onPrr(row)
-    elif table.name == hbr.name:
-      self.onHbr(row)
-    elif table.name == sbr.name:
-      self.onSbr(row)
-  
   def ifElse(cond, trueVal, falseVal):
     if cond:
       return trueVal
     else:
       return falseVal
   
-  def onPrr(self, row):
+  def on_prr(self, dataSource, row):
     countList, passList = self.hbinParts.setdefault(
       (row[prr.SITE_NUM], row[prr.HARD_BIN]), ([0], [None]))
     countList[0] += 1
@@ -134,13 +125,13 @@ class BinSummarizer(EventSource):
       if passList[0] != ifElse(row[prr.PART_FLG] & 0x08 == 0, 'P', 'F'):
         passList[0] = ' '
   
-  def onHbr(self, row):
+  def on_hbr(self, dataSource, row):
     if row[hbr.HEAD_NUM] == 255:
       self.overallHbrs[row[hbr.HBIN_NUM]] = row
     else:
       self.summaryHbrs[(row[hbr.SITE_NUM], row[hbr.HBIN_NUM])] = row
     
-  def onSbr(self, row):
+  def on_sbr(self, dataSource, row):
     if row[sbr.HEAD_NUM] == 255:
       self.overallSbrs[row[sbr.SBIN_NUM]] = row
     else:
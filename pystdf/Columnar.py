@@ -0,0 +1,442 @@
+#
+# PySTDF - The Pythonic STDF Parser
+# Copyright (C) 2006 Casey Marshall
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import re
+import numpy as np
+
+from pystdf.Types import RecordHeader
+from pystdf.IO import MappedStdf
+from pystdf import V4
+
+dtypeMap = {
+  "B1": "u1",
+  "U1": "u1",
+  "U2": "u2",
+  "U4": "u4",
+  "U8": "u8",
+  "I1": "i1",
+  "I2": "i2",
+  "I4": "i4",
+  "I8": "i8",
+  "R4": "f4",
+  "R8": "f8"
+}
+
+class ColumnBuffer:
+    """A 1-d numpy array grown geometrically as values are appended"""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, count):
+        need = self.size + count
+        if need > len(self.data):
+            data = np.empty(max(need, 2 * len(self.data)), self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        return need
+
+    def extend(self, values):
+        need = self.reserve(len(values))
+        if self.data.dtype == object:
+            # Assigning a sequence of lists would be taken as a 2-d array
+            for i, value in enumerate(values, self.size):
+                self.data[i] = value
+        else:
+            self.data[self.size:need] = values
+        self.size = need
+
+    def values(self):
+        return self.data[:self.size]
+
+class NumberColumn:
+    """Column of a fixed-width numeric field.  Values missing from short
+    records are tracked in a mask, created when the first one turns up."""
+
+    def __init__(self, stdfType):
+        self.stdfType = stdfType
+        self.buffer = ColumnBuffer(dtypeMap[stdfType])
+        self.mask = None
+
+    def extend(self, values):
+        if None in values:
+            if self.mask is None:
+                self.mask = ColumnBuffer(bool, len(self.buffer.data))
+                self.mask.extend(np.zeros(len(self.buffer), bool))
+            values = np.array(values, object)
+            missing = np.equal(values, None)
+            values[missing] = 0
+            self.mask.extend(missing)
+        elif self.mask is not None:
+            self.mask.extend(np.zeros(len(values), bool))
+        self.buffer.extend(values)
+
+    def values(self):
+        if self.mask is None:
+            return self.buffer.values()
+        return np.ma.MaskedArray(self.buffer.values(), self.mask.values())
+
+    def series(self, pd):
+        values = self.buffer.values()
+        if self.mask is None:
+            mask = np.zeros(len(values), bool)
+        else:
+            mask = self.mask.values()
+        if values.dtype.kind == 'f':
+            return pd.arrays.FloatingArray(values, mask)
+        return pd.arrays.IntegerArray(values, mask)
+
+class StringColumn:
+    """Column of a C1/Cn field, stored as integer codes into the distinct
+    strings seen, so a test name repeated on every PTR is kept once."""
+
+    def __init__(self):
+        self.codes = ColumnBuffer('i4')
+        self.index = {None: -1}
+        self.categories = []
+
+    def extend(self, values):
+        index = self.index
+        codes = list(map(index.get, values))
+        if None in codes:
+            # Strings not seen before
+            for i, code in enumerate(codes):
+                if code is None:
+                    value = values[i]
+                    code = index.get(value)
+                    if code is None:
+                        code = index[value] = len(self.categories)
+                        self.categories.append(value)
+                    codes[i] = code
+        self.codes.extend(codes)
+
+    def values(self):
+        categories = np.empty(len(self.categories) + 1, object)
+        categories[:-1] = self.categories
+        # Code -1 picks the trailing None
+        return categories.take(self.codes.values())
+
+    def series(self, pd):
+        return pd.Categorical.from_codes(self.codes.values(), self.categories)
+
+class RaggedArray:
+    """Variable length numeric arrays stored back to back in one array,
+    row i being values[offsets[i]:offsets[i+1]]"""
+
+    def __init__(self, values, offsets, mask):
+        self.values = values
+        self.offsets = offsets
+        self.mask = mask
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.mask is not None and self.mask[i]:
+            return None
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def tolist(self):
+        return [None if row is None else row.tolist()
+                for row in [self[i] for i in range(len(self))]]
+
+    def take(self, indices):
+        starts = self.offsets[:-1][indices]
+        lengths = np.diff(self.offsets)[indices]
+        offsets = np.zeros(len(lengths) + 1, self.offsets.dtype)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        mask = self.mask
+        if mask is not None:
+            mask = mask[indices]
+        return RaggedArray(self.values[gather], offsets, mask)
+
+class RaggedColumn:
+    """Column of a kxTYPE array of numbers"""
+
+    def __init__(self, stdfType):
+        self.buffer = ColumnBuffer(dtypeMap[stdfType])
+        self.offsets = ColumnBuffer('i8')
+        self.offsets.extend([0])
+        self.mask = None
+
+    def extend(self, values):
+        if None in values:
+            if self.mask is None:
+                self.mask = ColumnBuffer(bool)
+                self.mask.extend(np.zeros(len(self.offsets) - 1, bool))
+            self.mask.extend([value is None for value in values])
+        elif self.mask is not None:
+            self.mask.extend(np.zeros(len(values), bool))
+        offset = self.offsets.data[self.offsets.size - 1]
+        offsets = []
+        flat = []
+        for value in values:
+            if value:
+                flat.extend(value)
+                offset += len(value)
+            offsets.append(offset)
+        self.buffer.extend(flat)
+        self.offsets.extend(offsets)
+
+    def values(self):
+        mask = self.mask
+        if mask is not None:
+            mask = mask.values()
+        return RaggedArray(self.buffer.values(), self.offsets.values(), mask)
+
+    def series(self, pd):
+        return self.values().tolist()
+
+class ObjectColumn:
+    """Column of any other field, kept as Python objects"""
+
+    def __init__(self):
+        self.buffer = ColumnBuffer(object)
+
+    def extend(self, values):
+        self.buffer.extend(values)
+
+    def values(self):
+        return self.buffer.values()
+
+    def series(self, pd):
+        return self.buffer.values()
+
+def createColumn(stdfType):
+    if stdfType in dtypeMap:
+        return NumberColumn(stdfType)
+    elif stdfType in ("C1", "Cn"):
+        return StringColumn()
+    elif stdfType.startswith("k"):
+        arrayFmt = re.match('k\d+([A-Z][a-z0-9]+)', stdfType).group(1)
+        if arrayFmt in dtypeMap:
+            return RaggedColumn(arrayFmt)
+    return ObjectColumn()
+
+class ColumnTable:
+    """Columns of one record type.  Records are collected in blocks and
+    transposed into the columns a block at a time."""
+
+    blockSize = 4096
+
+    def __init__(self, recType):
+        self.recType = recType
+        self.columns = [createColumn(stdfType) for stdfType in recType.fieldStdfTypes]
+        self.rows = []
+        self.count = 0
+
+    def append(self, fields):
+        self.rows.append(fields)
+        if len(self.rows) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            for column, values in zip(self.columns, zip(*self.rows)):
+                column.extend(values)
+            self.count += len(self.rows)
+            self.rows = []
+
+    def names(self):
+        return self.recType.columnNames
+
+    def values(self):
+        self.flush()
+        return dict(zip(self.names(), [column.values() for column in self.columns]))
+
+    def frame(self):
+        import pandas as pd
+        self.flush()
+        return pd.DataFrame(dict(zip(self.names(),
+            [column.series(pd) for column in self.columns])))
+
+class ColumnarWriter:
+    """Collects records into per-record-type numpy columns: fixed-width
+    numbers in arrays of their STDF width, strings as codes into their
+    distinct values and numeric arrays as flat values with row offsets.
+    When record types are given, only those are decoded."""
+
+    def __init__(self, types=None):
+        if types is not None:
+            self.only = set(types)
+
+    def before_begin(self, dataSource):
+        self.tables = {}
+
+    def after_send(self, dataSource, data):
+        recType, fields = data
+        table = self.tables.get(recType)
+        if table is None:
+            table = self.tables[recType] = ColumnTable(recType)
+        table.append(fields)
+
+    def after_complete(self, dataSource):
+        for table in self.tables.values():
+            table.flush()
+
+    def tableName(self, recType):
+        return recType.__class__.__name__.upper()
+
+    def columns(self):
+        """Returns a dictionary of record name to {field name: array}"""
+        return dict([(self.tableName(recType), table.values())
+                     for recType, table in self.tables.items()])
+
+    def frames(self):
+        """Returns a dictionary of record name to DataFrame, numbers in
+        pandas nullable dtypes and strings as categoricals"""
+        return dict([(self.tableName(recType), table.frame())
+                     for recType, table in self.tables.items()])
+
+class BatchDecoder:
+    """Decodes many records of one type at once into the columns
+    ColumnarWriter would produce, using the byte order and record decoders
+    of the given parser.
+
+    The leading run of fixed-width numeric fields, the TEST_NUM..RESULT
+    prefix of a PTR, is read for all records of the same length with one
+    gather and a numpy structured dtype view.  The rest of a record is
+    looked up by its bytes and decoded in Python once per distinct tail,
+    which pays off as test programs repeat TEST_TXT, limits and UNITS or
+    leave them empty."""
+
+    chunkSize = 1 << 16
+
+    def __init__(self, recType, parser):
+        self.recType = recType
+        self.parser = parser
+        self.header = RecordHeader()
+        self.header.typ = recType.typ
+        self.header.sub = recType.sub
+        endian = parser.endian
+        fields = []
+        for name, stdfType in recType.fieldMap:
+            if stdfType not in dtypeMap:
+                break
+            fields.append((name, endian + dtypeMap[stdfType]))
+        self.prefix = np.dtype(fields)
+
+    def decode(self, buf, offsets, lengths):
+        """Decode the records whose headers start at the given offsets of
+        buf, a buffer over the file.  Returns {field name: array}."""
+        data = np.frombuffer(buf, np.uint8)
+        offsets = np.asarray(offsets, np.int64)
+        lengths = np.asarray(lengths, np.int64)
+        count = len(offsets)
+        prefix = self.prefix
+        width = len(prefix.names)
+        columns = dict([(name, np.zeros(count, prefix[name].newbyteorder('=')))
+                        for name in prefix.names])
+        masks = dict([(name, None) for name in prefix.names])
+
+        # Rows of the distinct tails and the row of each record
+        tails = ColumnTable(self.recType)
+        tailRows = {}
+        inverse = np.empty(count, np.intp)
+
+        def decodeRow(i):
+            start = int(offsets[i]) + 4
+            self.header.len = int(lengths[i])
+            return self.parser.decodeRecord(self.header, buf, start,
+                                            start + self.header.len)[1]
+
+        # Records too short for the whole prefix are decoded one by one
+        for i in np.nonzero(lengths < prefix.itemsize)[0]:
+            fields = decodeRow(i)
+            for name, value in zip(prefix.names, fields):
+                if value is None:
+                    if masks[name] is None:
+                        masks[name] = np.zeros(count, bool)
+                    masks[name][i] = True
+                else:
+                    columns[name][i] = value
+            inverse[i] = len(tails.rows) + tails.count
+            tails.append(fields)
+
+        for length in np.unique(lengths[lengths >= prefix.itemsize]):
+            records = np.nonzero(lengths == length)[0]
+            tailSize = length - prefix.itemsize
+            for chunk in range(0, len(records), self.chunkSize):
+                indices = records[chunk:chunk + self.chunkSize]
+                rows = data[offsets[indices, None] + 4 + np.arange(length)]
+                if width:
+                    values = rows[:, :prefix.itemsize].copy().view(prefix).ravel()
+                    for name in prefix.names:
+                        columns[name][indices] = values[name]
+
+                if tailSize:
+                    tailBytes = np.ascontiguousarray(rows[:, prefix.itemsize:])
+                    tailBytes = tailBytes.view(np.dtype((np.void, tailSize))).ravel()
+                    unique, first, rowOf = np.unique(tailBytes, return_index=True,
+                                                     return_inverse=True)
+                else:
+                    unique, first, rowOf = [b''], [0], np.zeros(len(indices), np.intp)
+                ids = np.empty(len(unique), np.intp)
+                for k, tail in enumerate(unique):
+                    key = (length, bytes(tail))
+                    row = tailRows.get(key)
+                    if row is None:
+                        row = tailRows[key] = len(tails.rows) + tails.count
+                        tails.append(decodeRow(indices[first[k]]))
+                    ids[k] = row
+                inverse[indices] = ids[rowOf]
+
+        result = {}
+        tailValues = tails.values()
+        for i, name in enumerate(self.recType.columnNames):
+            if i < width:
+                values = columns[name]
+                if masks[name] is not None:
+                    values = np.ma.MaskedArray(values, masks[name])
+            else:
+                values = tailValues[name].take(inverse)
+                if isinstance(values, np.ma.MaskedArray) and not values.mask.any():
+                    values = values.data
+            result[name] = values
+        return result
+
+def readBatchColumns(filename, types=(V4.ptr,)):
+    """Read the records of the given types with BatchDecoder, locating them
+    with a header-only scan.  Returns a dictionary of record name to
+    {field name: array}, as ColumnarWriter.columns()."""
+    keys = dict([((recType.typ, recType.sub), recType) for recType in types])
+    found = dict([(key, ([], [])) for key in keys])
+    with MappedStdf(filename) as stdf:
+        for offset, typ, sub, length in stdf.scan():
+            lists = found.get((typ, sub))
+            if lists is not None:
+                lists[0].append(offset)
+                lists[1].append(length)
+        # Drop a truncated record at the end of the file, as parse() does
+        result = {}
+        for key, (offsets, lengths) in found.items():
+            if offsets and offsets[-1] + 4 + lengths[-1] > len(stdf.view):
+                offsets.pop()
+                lengths.pop()
+            if offsets:
+                recType = keys[key]
+                decoder = BatchDecoder(recType, stdf)
+                result[recType.__class__.__name__.upper()] = decoder.decode(
+                    stdf.view, offsets, lengths)
+    return result
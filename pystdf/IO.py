@@ -18,9 +18,14 @@
 #
 import io
 import sys
+import mmap
+import gzip
+import threading
 
 import struct
 import re
+from collections.abc import Sequence
+from itertools import islice
 
 from pystdf.Types import *
 from pystdf import V4
@@ -38,6 +43,235 @@ def appendFieldParser(fn, action):
         return fields
     return newRecordParser
 
+def fixedFieldsDecoder(endian, stdfTypes):
+    """Create a decoder for a run of consecutive fixed-width fields.
+    The whole run is unpacked with a single precompiled struct; a run cut
+    short by the end of the record is decoded field by field instead."""
+    fmts = [packFormatMap[stdfType] for stdfType in stdfTypes]
+    run = struct.Struct(endian + ''.join(fmts))
+    size = run.size
+    parts = [struct.Struct(endian + fmt) for fmt in fmts]
+    chars = [i for i, stdfType in enumerate(stdfTypes) if stdfType == 'C1']
+    missing = [None] * len(fmts)
+    def decode(buf, pos, end, fields):
+        if pos + size <= end:
+            values = run.unpack_from(buf, pos)
+            if chars:
+                values = list(values)
+                for i in chars:
+                    values[i] = values[i].decode("ascii")
+            fields.extend(values)
+            return pos + size
+        if pos >= end:
+            fields.extend(missing)
+            return end
+        for i, part in enumerate(parts):
+            if pos + part.size > end:
+                fields.extend(missing[i:])
+                break
+            val, = part.unpack_from(buf, pos)
+            pos += part.size
+            if isinstance(val, bytes):
+                val = val.decode("ascii")
+            fields.append(val)
+        return end
+    return decode
+
+def decodeCn(buf, pos, end, fields):
+    if pos < end:
+        slen = buf[pos]
+        pos += 1
+        if pos + slen <= end:
+            fields.append(str(buf[pos:pos+slen], "ascii"))
+            return pos + slen
+    fields.append(None)
+    return end
+
+def decodeBn(buf, pos, end, fields):
+    if pos < end:
+        blen = buf[pos]
+        pos += 1
+        if pos + blen <= end:
+            fields.append(list(buf[pos:pos+blen]))
+            return pos + blen
+    fields.append(None)
+    return end
+
+def dnDecoder(endian):
+    bitCount = struct.Struct(endian + 'H')
+    def decode(buf, pos, end, fields):
+        if pos + 2 <= end:
+            dbitlen, = bitCount.unpack_from(buf, pos)
+            pos += 2
+            dlen = (dbitlen + 7) // 8
+            if pos + dlen <= end:
+                fields.append(list(buf[pos:pos+dlen]))
+                return pos + dlen
+        fields.append(None)
+        return end
+    return decode
+
+def arrayDecoder(endian, countIndex, stdfFmt):
+    """Create a decoder for a kxTYPE array whose count is held in an
+    earlier field of the record."""
+    if stdfFmt == 'N1':
+        # Nibble arrays are skipped, as in Parser.readArray
+        def decode(buf, pos, end, fields):
+            count = fields[countIndex]
+            fields.append(None)
+            if count is None:
+                return end
+            return min(pos + (count + 1) // 2, end)
+    elif stdfFmt == 'Cn':
+        def decode(buf, pos, end, fields):
+            count = fields[countIndex]
+            if count is None:
+                fields.append(None)
+                return end
+            arr = []
+            for i in range(count):
+                pos = decodeCn(buf, pos, end, arr)
+                if arr[-1] is None:
+                    fields.append(None)
+                    return end
+            fields.append(arr)
+            return pos
+    else:
+        fmt = packFormatMap[stdfFmt]
+        size = struct.calcsize(endian + fmt)
+        def decode(buf, pos, end, fields):
+            count = fields[countIndex]
+            if count is None:
+                fields.append(None)
+                return end
+            if pos + count * size > end:
+                fields.append(None)
+                return end
+            arr = list(struct.unpack_from('%s%d%s' % (endian, count, fmt), buf, pos))
+            if fmt == 'c':
+                arr = [val.decode("ascii") for val in arr]
+            fields.append(arr)
+            return pos + count * size
+    return decode
+
+def compileRecordSteps(recType, endian):
+    """Compile a record type into a list of decoder steps, one per run of
+    fixed-width fields, such as the leading TEST_NUM..RESULT prefix of a
+    PTR, which is unpacked with a single precompiled struct, and one per
+    Cn/Bn/Dn/kxTYPE field.  Returns (steps, lastArray), lastArray being the
+    number of fields up to and including the last kxTYPE array."""
+    steps = []
+    run = []
+    lastArray = 0
+    for i, stdfType in enumerate(recType.fieldStdfTypes):
+        if stdfType in packFormatMap:
+            run.append(stdfType)
+            continue
+        if run:
+            steps.append(fixedFieldsDecoder(endian, run))
+            run = []
+        if stdfType.startswith("k"):
+            fieldIndex, arrayFmt = re.match('k(\d+)([A-Z][a-z0-9]+)', stdfType).groups()
+            steps.append(arrayDecoder(endian, int(fieldIndex), arrayFmt))
+            lastArray = i + 1
+        elif stdfType == "Cn":
+            steps.append(decodeCn)
+        elif stdfType == "Bn":
+            steps.append(decodeBn)
+        elif stdfType == "Dn":
+            steps.append(dnDecoder(endian))
+        else:
+            raise ValueError("Cannot compile %s field of %s" % (
+                stdfType, recType.__class__.__name__))
+    if run:
+        steps.append(fixedFieldsDecoder(endian, run))
+    return steps, lastArray
+
+def compileRecordDecoder(recType, endian):
+    """Compile a record type into a function decoding a record body from
+    buf[pos:end], see compileRecordSteps.  Fields missing from a short
+    record are returned as None."""
+    steps, lastArray = compileRecordSteps(recType, endian)
+    width = len(recType.fieldStdfTypes)
+    def decode(buf, pos, end):
+        fields = []
+        for step in steps:
+            if pos >= end and len(fields) >= lastArray:
+                fields.extend([None] * (width - len(fields)))
+                break
+            pos = step(buf, pos, end, fields)
+        return fields
+    return decode
+
+class LazyLayout:
+    """The compiled steps of a record type, shared by its LazyRecords"""
+
+    def __init__(self, recType, endian):
+        self.steps, self.lastArray = compileRecordSteps(recType, endian)
+        self.width = len(recType.fieldStdfTypes)
+
+class LazyRecord(Sequence):
+    """The fields of one record, decoded from the raw record body as they
+    are accessed.  The decoder steps only run up to the step holding the
+    field asked for, so the trailing strings and arrays of a record are
+    never decoded when a sink does not look at them."""
+
+    __slots__ = ('layout', 'body', 'fields', 'pos', 'step')
+
+    def __init__(self, layout, body):
+        self.layout = layout
+        self.body = body
+        self.fields = []
+        self.pos = 0
+        self.step = 0
+
+    def __len__(self):
+        return self.layout.width
+
+    def __getitem__(self, index):
+        fields = self.fields
+        if index.__class__ is int and index >= 0:
+            if index < len(fields):
+                return fields[index]
+            if index < self.layout.width:
+                return self.decodeFields(index + 1)[index]
+            raise IndexError('record field index out of range')
+        # Slices and negative indexes
+        return self.decodeFields(self.layout.width)[index]
+
+    def __setitem__(self, index, value):
+        self.decodeFields(self.layout.width)[index] = value
+
+    def __iter__(self):
+        return iter(self.decodeFields(self.layout.width))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.decodeFields(self.layout.width))
+
+    def decodeFields(self, count):
+        """Run the decoder steps until at least count fields are decoded"""
+        fields = self.fields
+        layout = self.layout
+        steps = layout.steps
+        body = self.body
+        end = len(body)
+        pos = self.pos
+        step = self.step
+        while len(fields) < count:
+            if pos >= end and len(fields) >= layout.lastArray:
+                fields.extend([None] * (layout.width - len(fields)))
+                break
+            pos = steps[step](body, pos, end, fields)
+            step += 1
+        self.pos = pos
+        self.step = step
+        return fields
+
 class Parser(DataSource):
     def readAndUnpack(self, header, fmt):
         size = struct.calcsize(fmt)
@@ -148,33 +382,228 @@ class Parser(DataSource):
 
     def header(self, header): pass
 
+    def decodeRecord(self, header, buf, pos, end):
+        """Decode the record body held in buf[pos:end].
+        Returns (recType, fields), or None for unknown record types."""
+        key = (header.typ, header.sub)
+        layout = self.lazyLayouts.get(key)
+        if layout is not None:
+            return self.recordMap[key], LazyRecord(layout, bytes(buf[pos:end]))
+        decoder = self.recordDecoders.get(key)
+        if decoder is not None:
+            return self.recordMap[key], decoder(buf, pos, end)
+
+        elif key in self.recordMap:
+            with self.inputLock:
+                bakup = self.inp
+                self.inp = io.BytesIO(buf[pos:end])
+                try:
+                    recType = self.recordMap[key]
+                    recParser = self.recordParsers[key]
+                    fields = recParser(self, header, [])
+                finally:
+                    self.inp = bakup
+            if len(fields) < len(recType.columnNames):
+                fields += [None] * (len(recType.columnNames) - len(fields))
+            return recType, fields
+
+    def parseRecord(self, header, buf, pos, end):
+        """Decode the record body held in buf[pos:end] and send it to the sinks."""
+        if self.selected is not None and (header.typ, header.sub) not in self.selected:
+            return
+        data = self.decodeRecord(header, buf, pos, end)
+        if data is not None and self.sending:
+            self.send(data)
+
+    def addSink(self, sink):
+        """Register a sink.  A sink receiving send events may declare the
+        record types it needs in an 'only' attribute; records no sink asks
+        for are skipped without being decoded, all of them when only header
+        sinks are registered.  The record types of a sink's
+        on_<type> handlers (see DataSource) are decoded as well."""
+        DataSource.addSink(self, sink)
+        for recType in self.recTypes:
+            if callable(getattr(sink, 'on_' + recType.__class__.__name__.lower(), None)):
+                self.sending = True
+                self.sinkTypes = set(self.sinkTypes or ()) | set([recType])
+        if hasattr(sink, 'before_send') or hasattr(sink, 'after_send'):
+            self.sending = True
+            only = getattr(sink, 'only', None)
+            if only is None:
+                self.decodeAll = True
+            else:
+                self.sinkTypes = set(self.sinkTypes or ()) | set(only)
+        self.selectRecordTypes()
+
+    def selectRecordTypes(self):
+        if self.only is not None:
+            recTypes = self.only
+        elif self.decodeAll or not self.sending:
+            recTypes = None
+        else:
+            recTypes = self.sinkTypes
+        # Records pulled with iter_records() or records() go to the caller,
+        # parse() only decodes records when some sink receives them
+        if recTypes is None:
+            self.pullSelected = None
+        else:
+            self.pullSelected = set([(recType.typ, recType.sub) for recType in recTypes])
+        self.selected = self.pullSelected if self.sending else set()
+
     def parse_records(self, count=0):
+        if self.bufsize:
+            self.parse_buffered_records(count)
+            return
         i = 0
         self.eof = 0
-        fields = None
+        offset = self.inp.tell()
         try:
             while self.eof==0:
+                self.recordOffset = offset
                 header = self.readHeader()
                 self.header(header)
-                bakup = self.inp
-                self.inp = io.BytesIO(self.inp.read(header.len))
+                if self.selected is not None and (header.typ, header.sub) not in self.selected:
+                    # Skip over the body of a record nobody asked for
+                    if self.inp.seekable():
+                        self.inp.seek(header.len, 1)
+                    else:
+                        self.inp.read(header.len)
+                    offset += 4 + header.len
+                    if count:
+                        i += 1
+                        if i >= count: break
+                    continue
+                body = self.inp.read(header.len)
+                offset += 4 + len(body)
+                if len(body) < header.len and (header.typ, header.sub) in self.recordMap:
+                    self.eof = 1
+                    raise EofException()
+                self.parseRecord(header, body, 0, len(body))
+                if count:
+                    i += 1
+                    if i >= count: break
+        except EofException: pass
 
-                if (header.typ, header.sub) in self.recordMap:
+    def openBuffer(self):
+        """Returns the initial (view, base, pos, end) for buffered decoding."""
+        return memoryview(b''), self.inp.tell(), 0, 0
 
-                    recType = self.recordMap[(header.typ, header.sub)]
-                    recParser = self.recordParsers[(header.typ, header.sub)]
-                    fields = recParser(self, header, [])
-                    if len(fields) < len(recType.columnNames):
-                        fields += [None] * (len(recType.columnNames) - len(fields))
-                    self.send((recType, fields))
+    def fillBuffer(self, view, base, pos, size):
+        """Read the next chunk of the input, keeping the unconsumed tail of
+        the current one.  Returns the new (view, base, pos, end)."""
+        rest = view[pos:]
+        data = self.inp.read(max(self.bufsize, size - len(rest)))
+        if len(rest):
+            data = bytes(rest) + data
+        data = self.readAtLeast(data, size, self.bufsize)
+        return memoryview(data), base + pos, 0, len(data)
 
-                else:
-                    self.inp.read(header.len)
-                self.inp = bakup
+    def readAtLeast(self, data, size, chunk):
+        """Append reads of the input to data until it holds size bytes or
+        the input ends.  Pipes and other streams may return fewer bytes
+        than asked for, only an empty read is the end of the input."""
+        while len(data) < size:
+            more = self.inp.read(max(chunk, size - len(data)))
+            if not more:
+                break
+            data += more
+        return data
+
+    def parse_buffered_records(self, count=0):
+        """Decode records out of large chunks read from the input.  Record
+        bodies are sliced from a memoryview of the chunk and decoded with
+        unpack_from offsets, so no per-record read or BytesIO is needed."""
+        parseRecord = self.parseRecord
+        for header, view, pos, stop in self.buffered_records(count):
+            parseRecord(header, view, pos, stop)
+
+    def buffered_records(self, count=0):
+        """Generate (header, view, start, stop) for the records read in
+        chunks from the input, the body being view[start:stop].  The view
+        is only valid until the next record is generated."""
+        i = 0
+        self.eof = 0
+        unpackHeader = struct.Struct(self.endian + 'HBB').unpack_from
+        view, base, pos, end = self.openBuffer()
+        try:
+            while True:
+                if pos + 4 > end:
+                    view, base, pos, end = self.fillBuffer(view, base, pos, 4)
+                    if pos + 4 > end:
+                        self.eof = 1
+                        break
+                header = RecordHeader()
+                header.len, header.typ, header.sub = unpackHeader(view, pos)
+                stop = pos + 4 + header.len
+                if stop > end:
+                    view, base, pos, end = self.fillBuffer(view, base, pos, 4 + header.len)
+                    stop = pos + 4 + header.len
+                self.recordOffset = base + pos
+                self.header(header)
+                if stop > end:
+                    # Truncated record at the end of the file
+                    self.eof = 1
+                    break
+                yield header, view, pos + 4, stop
+                pos = stop
                 if count:
                     i += 1
                     if i >= count: break
         except EofException: pass
+        if self.eof == 0 and self.inp.seekable():
+            # Leave the stream just past the records consumed
+            self.inp.seek(base + pos)
+
+    def iter_records(self, count=0):
+        """Generate (recType, fields) for the selected records.  Records
+        are only read and decoded as they are pulled, without sending
+        begin/send/complete events, so the consumer may stop at any time."""
+        self.auto_detect_endian()
+        self.prepareDecoders()
+        selected = self.pullSelected
+        for header, view, pos, stop in self.buffered_records(count):
+            if selected is not None and (header.typ, header.sub) not in selected:
+                continue
+            data = self.decodeRecord(header, view, pos, stop)
+            if data is not None:
+                yield data
+
+    def scan(self):
+        """Header-only pass over the input.  Yields (offset, typ, sub, len)
+        for every record, reading only the 4-byte record headers and
+        skipping the record bodies without decoding them."""
+        self.auto_detect_endian()
+        unpackHeader = struct.Struct(self.endian + 'HBB').unpack_from
+        bufsize = self.bufsize or 1<<16
+        seekable = self.inp.seekable()
+        base = self.inp.tell()
+        data = b''
+        pos = 0
+        while True:
+            if pos + 4 > len(data):
+                if pos > len(data):
+                    # The next header lies beyond this chunk, skip over the
+                    # rest of the record body
+                    skip = pos - len(data)
+                    if seekable:
+                        self.inp.seek(skip, 1)
+                    else:
+                        while skip > 0:
+                            more = self.inp.read(skip)
+                            if not more:
+                                break
+                            skip -= len(more)
+                    data = b''
+                else:
+                    data = data[pos:]
+                base += pos
+                pos = 0
+                data = self.readAtLeast(data, 4, bufsize)
+                if len(data) < 4:
+                    break
+            length, typ, sub = unpackHeader(data, pos)
+            yield base + pos, typ, sub, length
+            pos += 4 + length
 
     def auto_detect_endian(self):
         if self.inp.tell() == 0:
@@ -186,6 +615,7 @@ class Parser(DataSource):
 
         try:
             self.auto_detect_endian()
+            self.prepareDecoders()
             self.parse_records(count)
             self.complete()
         except Exception as exception:
@@ -206,13 +636,51 @@ class Parser(DataSource):
             fn = appendFieldParser(fn, self.getFieldParser(stdfType))
         return fn
 
-    def __init__(self, recTypes=V4.records, inp=sys.stdin, reopen_fn=None, endian=None):
-        DataSource.__init__(self, ['header']);
+    def prepareDecoders(self):
+        if (self.compiled or self.lazy) and self.decoderEndian != self.endian:
+            self.compileRecordDecoders()
+
+    def compileRecordDecoders(self):
+        """Compile the record types for the current byte order.  Records
+        with Vn fields (GDR) are left to the field by field record parsers."""
+        recTypes = [recType for recType in self.recTypes
+                    if "Vn" not in recType.fieldStdfTypes]
+        if self.compiled:
+            self.recordDecoders = dict(
+                [ ( (recType.typ, recType.sub), compileRecordDecoder(recType, self.endian) )
+                  for recType in recTypes ])
+        if self.lazy:
+            self.lazyLayouts = dict(
+                [ ( (recType.typ, recType.sub), LazyLayout(recType, self.endian) )
+                  for recType in recTypes ])
+        self.decoderEndian = self.endian
+
+    def __init__(self, recTypes=V4.records, inp=sys.stdin, reopen_fn=None, endian=None, compiled=True, bufsize=1<<20, only=None, lazy=False):
+        DataSource.__init__(self, ['header'], recTypes);
         self.eof = 1
         self.recTypes = set(recTypes)
         self.inp = inp
         self.reopen_fn = reopen_fn
         self.endian = endian
+        self.compiled = compiled
+        self.bufsize = bufsize
+        self.lazy = lazy
+        self.recordDecoders = {}
+        self.lazyLayouts = {}
+        self.decoderEndian = None
+        self.recordOffset = 0
+        # Held while a record is decoded field by field out of a swapped-in self.inp
+        self.inputLock = threading.Lock()
+
+        # Whether any sink listens to send events or records at all
+        self.sending = False
+
+        # Record types to decode, from the only argument or else from the
+        # union of the types the sinks declare, None meaning all
+        self.only = only
+        self.sinkTypes = None
+        self.decodeAll = False
+        self.selectRecordTypes()
 
         self.recordMap = dict(
             [ ( (recType.typ, recType.sub), recType )
@@ -256,3 +724,162 @@ class Parser(DataSource):
             12: lambda header: self.readDn(header),
             13: lambda header: self.readField(header, "U1")
         }
+
+class MappedStdf(Parser):
+    """A Parser over a memory-mapped STDF file.
+    parse() decodes straight out of the mapping, and single records can be
+    fetched at any time with record_at(offset) or records(start, stop)
+    without re-opening or seeking a stream.  Once the byte order is known,
+    which detectMappedEndian() settles, record_at() may be called while
+    parse() runs on another thread."""
+
+    def __init__(self, filename, recTypes=V4.records, endian=None, compiled=True, only=None, lazy=False):
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        Parser.__init__(self, recTypes, inp=self.file, endian=endian,
+                        compiled=compiled, bufsize=len(self.view), only=only,
+                        lazy=lazy)
+        self.unpackHeader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.map.close()
+            self.file.close()
+            self.view = None
+
+    def openBuffer(self):
+        return self.view, 0, self.inp.tell(), len(self.view)
+
+    def fillBuffer(self, view, base, pos, size):
+        # The whole file is mapped, there is nothing more to read
+        return view, base, pos, len(view)
+
+    def prepareDecoders(self):
+        Parser.prepareDecoders(self)
+        self.unpackHeader = struct.Struct(self.endian + 'HBB').unpack_from
+
+    def auto_detect_endian(self):
+        # Read the byte order from the mapping, without resetting self.endian
+        # and seeking the input like Parser does
+        self.detectMappedEndian()
+
+    def detectMappedEndian(self):
+        if self.endian is None:
+            if self.view[2] != 0 and self.view[3] != 10:
+                raise InitialSequenceException()
+            if self.view[4] == 2:
+                self.endian = '<'
+            else:
+                self.endian = '>'
+        self.prepareDecoders()
+
+    def readRecordHeader(self, offset):
+        header = RecordHeader()
+        header.len, header.typ, header.sub = self.unpackHeader(self.view, offset)
+        return header
+
+    def parseRange(self, start, stop, context=()):
+        """Parse the records whose headers start within the file offsets
+        [start, stop), after sending the records at the context offsets,
+        so a slice of a file can be parsed with the state it depends on."""
+        self.begin()
+
+        try:
+            self.detectMappedEndian()
+            size = len(self.view)
+            for offset in context:
+                self.parseRecordAt(offset)
+            offset = start
+            while offset + 4 <= stop:
+                end = self.parseRecordAt(offset)
+                if end > size:
+                    break
+                offset = end
+            self.complete()
+        except Exception as exception:
+            self.cancel(exception)
+            raise
+
+    def parseRecordAt(self, offset):
+        """Send the record at offset to the sinks, returns where it ends"""
+        header = self.readRecordHeader(offset)
+        end = offset + 4 + header.len
+        self.recordOffset = offset
+        self.header(header)
+        if end <= len(self.view):
+            self.parseRecord(header, self.view, offset + 4, end)
+        return end
+
+    def record_at(self, offset):
+        """Decode the record whose header starts at the given file offset.
+        Returns (recType, fields), or None for unknown record types."""
+        if self.unpackHeader is None:
+            self.detectMappedEndian()
+        header = self.readRecordHeader(offset)
+        end = offset + 4 + header.len
+        if end > len(self.view):
+            raise EofException()
+        return self.decodeRecord(header, self.view, offset + 4, end)
+
+    def scan(self):
+        """Header-only pass over the mapping, see Parser.scan()"""
+        if self.unpackHeader is None:
+            self.detectMappedEndian()
+        unpackHeader = self.unpackHeader
+        view = self.view
+        size = len(view)
+        offset = self.inp.tell()
+        while offset + 4 <= size:
+            length, typ, sub = unpackHeader(view, offset)
+            yield offset, typ, sub, length
+            offset += 4 + length
+
+    def records(self, start=0, stop=None):
+        """Generate (offset, recType, fields) for the selected records whose
+        headers start within the file offsets [start, stop)."""
+        if self.unpackHeader is None:
+            self.detectMappedEndian()
+        size = len(self.view)
+        if stop is None or stop > size:
+            stop = size
+        offset = start
+        while offset + 4 <= stop:
+            header = self.readRecordHeader(offset)
+            end = offset + 4 + header.len
+            if end > size:
+                break
+            if self.pullSelected is None or (header.typ, header.sub) in self.pullSelected:
+                data = self.decodeRecord(header, self.view, offset + 4, end)
+                if data is not None:
+                    yield (offset,) + data
+            offset = end
+
+def iter_records(path, types=None, **kwargs):
+    """Generate (recType, fields) for the records of the STDF file at path,
+    or only for the given record types.  The file (.gz files are read
+    through gzip) is read a chunk at a time as records are pulled, and is
+    closed when the generator finishes or is closed."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as inp:
+        parser = Parser(inp=inp, only=types, **kwargs)
+        yield from parser.iter_records()
+
+def iter_record_batches(path, n, types=None, **kwargs):
+    """Generate lists of up to n (recType, fields), see iter_records()"""
+    records = iter_records(path, types, **kwargs)
+    try:
+        while True:
+            batch = list(islice(records, n))
+            if not batch:
+                break
+            yield batch
+    finally:
+        records.close()
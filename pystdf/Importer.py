@@ -22,7 +22,8 @@
 import numpy as np
 import pandas as pd
 from pystdf.IO import Parser
-from pystdf.Writers import TextWriter
+from pystdf.Writers import TextWriter, ParquetWriter, ExcelWriter
+from pystdf.Columnar import ColumnarWriter
 
 class MemoryWriter:
     def __init__(self):
@@ -84,3 +85,39 @@ def STDF2DataFrame(fname):
     for k,v in BigTable.items():
         BigTable[k] = pd.DataFrame(v)
     return BigTable
+
+def STDF2Columns(fname, types=None):
+    """ Convert STDF to a dictionary of per-record-type column arrays,
+        optionally restricted to the given record types
+    """
+    with open(fname,'rb') as fin:
+        p = Parser(inp=fin)
+        storage = ColumnarWriter(types)
+        p.addSink(storage)
+        p.parse()
+    return storage.columns()
+
+def STDF2Parquet(fname, directory=None, types=None):
+    """ Convert STDF to one Parquet file per record type in the given
+        directory, by default next to the STDF file, optionally
+        restricted to the given record types
+    """
+    if directory is None:
+        directory = fname + "_parquet"
+    with open(fname,'rb') as fin:
+        p = Parser(inp=fin)
+        p.addSink(ParquetWriter(directory, types))
+        p.parse()
+    return directory
+
+def STDF2Excel(fname, xlsname=None, types=None):
+    """ Convert STDF to an xlsx workbook with one worksheet per record
+        type, streamed without building DataFrames
+    """
+    if xlsname is None:
+        xlsname = fname + ".xlsx"
+    with open(fname,'rb') as fin:
+        p = Parser(inp=fin)
+        p.addSink(ExcelWriter(xlsname, types))
+        p.parse()
+    return xlsname
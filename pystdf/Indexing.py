@@ -22,7 +22,7 @@ from pystdf import V4
 
 class StreamIndexer:
   def before_header(self, dataSource, header):
-    self.position = dataSource.inp.tell() - 4
+    self.position = dataSource.recordOffset
     self.header = header
 
 class SessionIndexer:
@@ -17,6 +17,12 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
+import os
+import sys
+import struct
+import hashlib
+from array import array
+
 from pystdf.Types import *
 from pystdf.Indexing import *
 from pystdf import V4
@@ -36,6 +42,15 @@ class StreamMapper(StreamIndexer):
         rectype = self.__rec_map.get(key, UnknownRecord(*key))
         self.types.append(rectype)
 
+    def extend(self, records):
+        """Map the (offset, typ, sub, len) tuples of a Parser.scan() pass"""
+        for offset, typ, sub, length in records:
+            self.indexes.append(offset)
+            rectype = self.__rec_map.get((typ, sub))
+            if rectype is None:
+                rectype = UnknownRecord(typ, sub)
+            self.types.append(rectype)
+
 class MaterialMapper(MaterialIndexer):
     indexable_types = set([V4.wir, V4.wrr, V4.pir, V4.prr, V4.ptr, V4.mpr, V4.ftr])
     per_part_types = set([V4.pir, V4.prr, V4.ptr, V4.mpr, V4.ftr])
@@ -63,6 +78,196 @@ class MaterialMapper(MaterialIndexer):
             self.insertionid.append(None)
             self.partid.append(None)
 
+class RecordTypeColumn:
+    """Sequence view mapping the (rec_typ, rec_sub) columns of a RecordIndex
+    back to record type instances, like StreamMapper.types"""
+
+    def __init__(self, typs, subs, rec_map):
+        self.typs = typs
+        self.subs = subs
+        self.rec_map = rec_map
+
+    def __len__(self):
+        return len(self.typs)
+
+    def __getitem__(self, i):
+        key = (self.typs[i], self.subs[i])
+        return self.rec_map.get(key, None) or UnknownRecord(*key)
+
+class OptionalColumn:
+    """Sequence view over an id column, reading the missing marker as None"""
+
+    missing = -1
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        value = self.values[i]
+        if value == self.missing:
+            return None
+        return value
+
+class RecordIndex:
+    """Compact columnar index of every record in an STDF file.
+
+    Holds the record offsets and (rec_typ, rec_sub) pairs collected by
+    StreamMapper and the wafer/insertion/part ids of MaterialMapper in typed
+    arrays, and can be saved next to the STDF file as a .stdfidx sidecar so
+    the file can be browsed again without re-parsing it.  The indexes, types,
+    waferid, insertionid and partid attributes mirror the mapper lists."""
+
+    magic = b'STDFIDX1'
+    header = struct.Struct('<8sQq20sQ')
+    column_names = ('offsets', 'typs', 'subs',
+                    'waferids', 'insertionids', 'partids')
+
+    # Size and number of blocks at the start of the file hashed into the key
+    key_block_size = 1 << 16
+    key_blocks = 4
+
+    def __init__(self, types=V4.records):
+        self.offsets = array('Q')
+        self.typs = array('B')
+        self.subs = array('B')
+        self.waferids = array('q')
+        self.insertionids = array('q')
+        self.partids = array('q')
+        self.rec_map = dict([((recType.typ, recType.sub), recType)
+                             for recType in types])
+        self.indexes = self.offsets
+        self.types = RecordTypeColumn(self.typs, self.subs, self.rec_map)
+        self.waferid = OptionalColumn(self.waferids)
+        self.insertionid = OptionalColumn(self.insertionids)
+        self.partid = OptionalColumn(self.partids)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset, typ, sub):
+        missing = OptionalColumn.missing
+        self.offsets.append(offset)
+        self.typs.append(typ)
+        self.subs.append(sub)
+        self.waferids.append(missing)
+        self.insertionids.append(missing)
+        self.partids.append(missing)
+
+    def setMaterial(self, waferid, insertionid, partid):
+        """Set the material ids of the most recently appended record"""
+        self.waferids[-1] = waferid
+        self.insertionids[-1] = insertionid
+        if partid is not None:
+            self.partids[-1] = partid
+
+    @staticmethod
+    def filenameFor(filename):
+        return filename + '.stdfidx'
+
+    @classmethod
+    def fileKey(cls, filename):
+        """Identify the current contents of an STDF file by size, mtime and
+        a hash of its first blocks"""
+        st = os.stat(filename)
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            digest.update(f.read(cls.key_block_size * cls.key_blocks))
+        return st.st_size, st.st_mtime_ns, digest.digest()
+
+    def save(self, filename, key=None):
+        """Write the sidecar index of the given STDF file"""
+        if key is None:
+            key = self.fileKey(filename)
+        size, mtime, digest = key
+        path = self.filenameFor(filename)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.header.pack(self.magic, size, mtime, digest, len(self)))
+            for name in self.column_names:
+                column = getattr(self, name)
+                if sys.byteorder == 'big':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                f.write(column.tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, filename, types=V4.records):
+        """Read the sidecar index of the given STDF file.
+        Returns None if there is no index or it does not match the file."""
+        path = cls.filenameFor(filename)
+        try:
+            key = cls.fileKey(filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        if len(data) < cls.header.size:
+            return None
+        magic, size, mtime, digest, count = cls.header.unpack_from(data)
+        if magic != cls.magic or (size, mtime, digest) != key:
+            return None
+
+        index = cls(types)
+        pos = cls.header.size
+        for name in cls.column_names:
+            column = getattr(index, name)
+            nbytes = count * column.itemsize
+            if pos + nbytes > len(data):
+                return None
+            column.frombytes(data[pos:pos+nbytes])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            pos += nbytes
+        return index
+
+class IndexMapper(StreamIndexer, MaterialIndexer):
+    """Sink building a RecordIndex, the combination of StreamMapper and
+    MaterialMapper"""
+
+    # Only the records carrying material ids need decoding
+    only = MaterialMapper.indexable_types
+
+    def __init__(self, types=V4.records):
+        self.index = RecordIndex(types)
+
+    def before_header(self, dataSource, header):
+        StreamIndexer.before_header(self, dataSource, header)
+        self.index.append(self.position, header.typ, header.sub)
+
+    def before_send(self, dataSource, data):
+        MaterialIndexer.before_send(self, dataSource, data)
+        rectype, rec = data
+        if rectype in MaterialMapper.indexable_types:
+            head = rec[rectype.HEAD_NUM]
+            partid = None
+            if rectype in MaterialMapper.per_part_types:
+                partid = self.getCurrentPart(head, rec[rectype.SITE_NUM])
+            self.index.setMaterial(self.getCurrentWafer(head),
+                                   self.getCurrentInsertion(head), partid)
+
+def mapFile(filename, types=V4.records):
+    """Return the RecordIndex of an STDF file, reusing its .stdfidx sidecar
+    when it is up to date and otherwise parsing the file and saving one"""
+    index = RecordIndex.load(filename, types)
+    if index is None:
+        from pystdf.IO import MappedStdf
+        key = RecordIndex.fileKey(filename)
+        mapper = IndexMapper(types)
+        with MappedStdf(filename, types) as stdf:
+            stdf.addSink(mapper)
+            stdf.parse()
+        index = mapper.index
+        try:
+            index.save(filename, key)
+        except (IOError, OSError):
+            pass
+    return index
+
 if __name__ == '__main__':
     from pystdf.IO import Parser
     from pystdf.Writers import AtdfWriter
@@ -72,8 +277,7 @@ if __name__ == '__main__':
     f = open(filename, 'rb')
     p=Parser(inp=f)
     record_mapper = StreamMapper()
-    p.addSink(record_mapper)
-    p.parse()
+    record_mapper.extend(p.scan())
     f.close()
 
     for index, rectype in zip(record_mapper.indexes, record_mapper.types):
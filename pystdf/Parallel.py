@@ -0,0 +1,165 @@
+#
+# PySTDF - The Pythonic STDF Parser
+# Copyright (C) 2006 Casey Marshall
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import struct
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pystdf.IO import MappedStdf
+from pystdf import V4
+
+class FileRange:
+    """A slice [start, stop) of an STDF file to parse on its own, with the
+    offsets of the earlier records to send first as context."""
+
+    def __init__(self, start, stop, context):
+        self.start = start
+        self.stop = stop
+        self.context = context
+
+    def __repr__(self):
+        return '<FileRange %d-%d, %d context records>' % (
+            self.start, self.stop, len(self.context))
+
+# Records that define names later records refer to by index.  A range gets
+# all of them that come before it, wherever they appear in the file.
+definitions = (V4.pmr, V4.pgr, V4.plr, V4.psr, V4.nmr, V4.sdr)
+
+def mprReturnIndexTest(view, endian, offset, length):
+    """TEST_NUM of the MPR at offset if it has RTN_INDX, else None.  Only
+    walks the field lengths up to RTN_INDX, without decoding the record."""
+    body = offset + 4
+    end = body + length
+    if length < 12:
+        return None
+    testNum, = struct.unpack_from(endian + 'I', view, body)
+    rtnCount, rsltCount = struct.unpack_from(endian + 'HH', view, body + 8)
+    if not rtnCount:
+        return None
+    # RTN_STAT nibbles and RTN_RSLT, then TEST_TXT and ALARM_ID
+    pos = body + 12 + (rtnCount + 1) // 2 + 4 * rsltCount
+    for _ in range(2):
+        if pos >= end:
+            return None
+        pos += 1 + view[pos]
+    # OPT_FLAG to HLM_SCAL, then LO_LIMIT, HI_LIMIT, START_IN and INCR_IN
+    pos += 4 + 16
+    if pos + 2 * rtnCount > end:
+        return None
+    return testNum
+
+def splitFile(filename, parts, sticky=(V4.wir, V4.bps), definitions=definitions):
+    """Split an STDF file into up to the given number of FileRanges of
+    similar size, using a header-only scan.  Ranges start at the first PIR
+    of a touchdown.  The context of a range is every record before the
+    first PIR of the file, every definition record and the latest record
+    of each sticky type before the range, and for each test number the
+    latest MPR before the range that has RTN_INDX, which later MPRs of the
+    test may leave out."""
+    pirKey = (V4.pir.typ, V4.pir.sub)
+    mprKey = (V4.mpr.typ, V4.mpr.sub)
+    stickyKeys = set([(recType.typ, recType.sub) for recType in sticky])
+    definitionKeys = set([(recType.typ, recType.sub) for recType in definitions])
+    header = []
+    starts = []
+    stickyOffsets = dict([(key, []) for key in stickyKeys])
+    definitionOffsets = []
+    mprOffsets = {}    # TEST_NUM -> offsets of its MPRs with RTN_INDX
+    with MappedStdf(filename) as stdf:
+        prevPir = False
+        for offset, typ, sub, length in stdf.scan():
+            key = (typ, sub)
+            isPir = key == pirKey
+            if isPir and not prevPir:
+                starts.append(offset)
+            prevPir = isPir
+            if key == mprKey:
+                testNum = mprReturnIndexTest(stdf.view, stdf.endian, offset, length)
+                if testNum is not None:
+                    mprOffsets.setdefault(testNum, []).append(offset)
+            if not starts:
+                header.append(offset)
+            elif key in stickyKeys:
+                stickyOffsets[key].append(offset)
+            elif key in definitionKeys:
+                definitionOffsets.append(offset)
+        size = len(stdf.view)
+
+    # Pick the touchdown starts closest to even byte splits
+    splits = []
+    for part in range(1, parts):
+        i = bisect_left(starts, size * part // parts)
+        if i < len(starts) and starts[i] not in splits and (not splits or starts[i] > splits[-1]):
+            splits.append(starts[i])
+
+    ranges = []
+    bounds = [0] + splits + [size]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        context = []
+        if start:
+            context = list(header)
+            context.extend(definitionOffsets[:bisect_left(definitionOffsets, start)])
+            for offsets in list(stickyOffsets.values()) + list(mprOffsets.values()):
+                i = bisect_left(offsets, start)
+                if i:
+                    context.append(offsets[i - 1])
+            context = sorted(set(context))
+        ranges.append(FileRange(start, stop, context))
+    return ranges
+
+def parseRange(filename, fileRange, sinkFactory):
+    """Parse one FileRange into a new sink, returning the sink"""
+    sink = sinkFactory()
+    with MappedStdf(filename) as stdf:
+        stdf.addSink(sink)
+        stdf.parseRange(fileRange.start, fileRange.stop, fileRange.context)
+    return sink
+
+def iterParallelParse(filename, sinkFactory, workers=None, parts=None, sticky=(V4.wir, V4.bps)):
+    """Parse an STDF file in worker processes like parallelParse, but yield
+    (FileRange, sink) in file order as soon as each range is done.  At most
+    twice as many ranges as workers are parsed or held ahead of the one
+    the caller is at, so with enough parts memory stays bounded."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if parts is None:
+        parts = workers
+    ranges = splitFile(filename, parts, sticky)
+    if len(ranges) == 1 or workers == 1:
+        for fileRange in ranges:
+            yield fileRange, parseRange(filename, fileRange, sinkFactory)
+        return
+    with ProcessPoolExecutor(min(workers, len(ranges))) as pool:
+        pending = deque()
+        for fileRange in ranges:
+            if len(pending) >= 2 * workers:
+                yield pending[0][0], pending.popleft()[1].result()
+            pending.append((fileRange, pool.submit(parseRange, filename, fileRange, sinkFactory)))
+        while pending:
+            yield pending[0][0], pending.popleft()[1].result()
+
+def parallelParse(filename, sinkFactory, workers=None, parts=None, sticky=(V4.wir, V4.bps)):
+    """Parse an STDF file in worker processes.  The file is split with
+    splitFile, every range is parsed into a sink made by sinkFactory, a
+    picklable callable, and the sinks are returned in file order for the
+    caller to merge.  Returns (ranges, sinks)."""
+    parsed = list(iterParallelParse(filename, sinkFactory, workers, parts, sticky))
+    return [fileRange for fileRange, sink in parsed], [sink for fileRange, sink in parsed]
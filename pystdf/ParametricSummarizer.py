@@ -42,19 +42,12 @@ class ParametricSummarizer(EventSource):
 			self.summaryMap[key] = SummaryStatistics(values)
 		self.parametricSummaryReady(dataSource)
 	
-	def before_send(self, dataSource, data):
-		table, row = data
-		if table.name == ptr.name:
-			self.onPtr(row)
-		elif table.name == mpr.name:
-			self.onMpr(row)
-	
-	def onPtr(self, row):
+	def on_ptr(self, dataSource, row):
 		values = self.rawMap.setdefault((
 			row[ptr.SITE_NUM],row[ptr.TEST_NUM],0), [])
 		values.append(row[ptr.RESULT])
 	
-	def onMpr(self, row):
+	def on_mpr(self, dataSource, row):
 		for i in xrange(row[mpr.RSLT_CNT]):
 			values = self.rawMap.setdefault((row[ptr.SITE_NUM],row[ptr.TEST_NUM],i), [])
 			values.append(row[mpr.RTN_RSLT][i])
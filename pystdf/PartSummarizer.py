@@ -34,7 +34,7 @@ class PartSummarizer(Pipeline.EventSource):
     FLAG_OVERALL = 0x01
     
     def __init__(self):
-        EventSource.__init__(self, ['partSummaryReady'])
+        Pipeline.EventSource.__init__(self, ['partSummaryReady'])
     
     def partSummaryReady(self, dataSource): pass
     
@@ -72,14 +72,7 @@ class PartSummarizer(Pipeline.EventSource):
     def before_complete(self, dataSource):
         self.partSummaryReady(dataSource)
     
-    def before_send(self, dataSource, data):
-        table, row = data
-        if table.name == prr.name:
-            self.onPrr(row)
-        elif table.name == pcr.name:
-            self.onPcr(row)
-    
-    def onPrr(self, row):
+    def on_prr(self, dataSource, row):
         partCnt, goodCnt, abrtCnt = self.pcSynth.setdefault(row[prr.SITE_NUM], 
           ([0], [0], [0]))
         partCnt[0] += 1
@@ -88,7 +81,7 @@ class PartSummarizer(Pipeline.EventSource):
         if row[prr.PART_FLG] & 0x04 == 0:
             abrtCnt[0] += 1
     
-    def onPcr(self, row):
+    def on_pcr(self, dataSource, row):
         if row[pcr.HEAD_NUM] == 255:
             self.overall = [
                 filterNull(value) for value in row]
@@ -18,6 +18,7 @@
 #
 
 import sys
+import warnings
 
 def appendPrefixAction(fn, ds, action):
   """Create a function that injects a call to 'action' prior to given function 'fn'"""
@@ -33,6 +34,27 @@ def appendSuffixAction(fn, sink, action):
     action(sink, *args)
   return new_fn
 
+def dispatchAction(fn, ds, before, after):
+  """Create a function that calls the 'before' actions, 'fn' and then the
+  'after' actions in one flat loop each, rather than through one nested
+  closure per action"""
+  if len(before) + len(after) <= 2:
+    # The usual cases of one or two handlers, e.g. a profiler's after_send
+    # or the explorer's two before_header passes, get the nested closures
+    # addSink always built, which cost less than the loops below
+    for action in after:
+      fn = appendSuffixAction(fn, ds, action)
+    for action in reversed(before):
+      fn = appendPrefixAction(fn, ds, action)
+    return fn
+  def new_fn(*args):
+    for action in before:
+      action(ds, *args)
+    fn(*args)
+    for action in after:
+      action(ds, *args)
+  return new_fn
+
 class EventSource:
   """EventSource
   A generic base class for something that originates events (a source)
@@ -44,36 +66,86 @@ class EventSource:
   The sink defines methods based on the event name in order to receive it.
   Event method names in the sink with a 'before_' prefix will be invoked
   prior to the event occuring, similarly, a method with the 'after_' suffix
-  will be invoked after the event occurs."""
+  will be invoked after the event occurs.  'before_' handlers are called
+  latest registered sink first, 'after_' handlers in registration order."""
   
   def __init__(self, eventNames):
     self.eventNames = eventNames
+    # Event name -> (event method, before handlers, after handlers)
+    self.eventHandlers = dict([(eventName, (getattr(self, eventName), [], []))
+                               for eventName in eventNames])
   
   def addSink(self, sink):
     "Register a DataSink to receive the events it has defined"
     for eventName in self.eventNames:
+      fn, before, after = self.eventHandlers[eventName]
       preEventName = 'before_' + eventName
       postEventName = 'after_' + eventName
       if hasattr(sink, preEventName):
-        setattr(self, eventName, 
-          appendPrefixAction(
-              getattr(self, eventName),
-              self, getattr(sink, preEventName)))
+        before.insert(0, getattr(sink, preEventName))
       if hasattr(sink, postEventName):
-        setattr(self, eventName, 
-          appendSuffixAction(
-              getattr(self, eventName),
-              self, getattr(sink, postEventName)))
+        after.append(getattr(sink, postEventName))
+      if before or after:
+        setattr(self, eventName, dispatchAction(fn, self, before, after))
 
 class DataSource(EventSource):
+  """DataSource
+  An EventSource sending (recType, fields) records.  Besides before_send
+  and after_send, a sink may define on_<type> methods, e.g.
+  on_ptr(dataSource, fields), which are called for records of that type
+  only.  They run as part of the send event itself: after the before_send
+  handlers and before the after_send handlers.  The record types are those
+  given, V4.records by default; other on_ attributes of a sink are not
+  called and draw a warning."""
   
-  def __init__(self, add_events):
+  def __init__(self, add_events, recTypes=None):
     EventSource.__init__(self, ['begin', 'send', 'complete', 'cancel'] + add_events)
+    if recTypes is None:
+      from pystdf import V4
+      recTypes = V4.records
+    # on_<type> method name -> handlers, and the handlers per record type
+    # as routeRecord has looked them up
+    self.recordHandlerNames = dict([('on_' + recType.__class__.__name__.lower(), [])
+                                    for recType in recTypes])
+    self.recordHandlers = {}
+    self.routing = False
+  
+  def addSink(self, sink):
+    "Register a DataSink to receive the events and records it has defined"
+    handlers = []
+    for name in dir(sink):
+      if not name.startswith('on_'):
+        continue
+      handler = getattr(sink, name)
+      if name in self.recordHandlerNames and callable(handler):
+        handlers.append((name, handler))
+      else:
+        warnings.warn('%s.%s is not called, it is not a method named after a record type'
+                      % (sink.__class__.__name__, name), stacklevel=2)
+    if handlers and not self.routing:
+      # From the first on_<type> handler on, the send event routes records
+      fn, before, after = self.eventHandlers['send']
+      self.eventHandlers['send'] = (self.routeRecord, before, after)
+      self.send = self.routeRecord
+      self.routing = True
+    EventSource.addSink(self, sink)
+    for name, handler in handlers:
+      self.recordHandlerNames[name].append(handler)
+    self.recordHandlers = {}
   
   def begin(self): pass
   
   def send(self, data): pass
   
+  def routeRecord(self, data):
+    recType, fields = data
+    handlers = self.recordHandlers.get(recType)
+    if handlers is None:
+      handlers = self.recordHandlers[recType] = self.recordHandlerNames.get(
+        'on_' + recType.__class__.__name__.lower()) or ()
+    for handler in handlers:
+      handler(self, fields)
+  
   def complete(self): pass
   
   def cancel(self, exception): pass
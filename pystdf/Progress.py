@@ -0,0 +1,67 @@
+#
+# PySTDF - The Pythonic STDF Parser
+# Copyright (C) 2006 Casey Marshall
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import time
+
+class ProgressReporter:
+    """Sink reporting how far a parse has got, as a percentage of total
+    bytes, to callback(percent).  It only listens to header events and
+    reads the parser's recordOffset, so a record costs one comparison.
+    The clock is read once every minBytes bytes, the callback is called at
+    most once every minInterval seconds, and only when the percentage
+    changed.  Subclasses may override report() instead of passing a
+    callback."""
+
+    def __init__(self, callback=None, total=0, minBytes=1<<16, minInterval=0.1):
+        self.callback = callback
+        self.total = total
+        self.minBytes = minBytes
+        self.minInterval = minInterval
+        self.reset()
+
+    def reset(self):
+        self.nextOffset = 0
+        self.nextTime = 0
+        self.percent = None
+
+    def before_begin(self, dataSource):
+        self.reset()
+
+    def before_header(self, dataSource, header):
+        offset = dataSource.recordOffset
+        if offset < self.nextOffset:
+            return
+        self.nextOffset = offset + self.minBytes
+        now = time.monotonic()
+        if now < self.nextTime:
+            return
+        percent = min(100, offset * 100 // self.total) if self.total else 0
+        if percent != self.percent:
+            self.nextTime = now + self.minInterval
+            self.percent = percent
+            self.report(dataSource, percent)
+
+    def after_complete(self, dataSource):
+        if self.percent != 100:
+            self.percent = 100
+            self.report(dataSource, 100)
+
+    def report(self, dataSource, percent):
+        if self.callback is not None:
+            self.callback(percent)
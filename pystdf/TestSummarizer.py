@@ -94,18 +94,7 @@ class TestSummarizer(EventSource):
 #        overallCount[0] += partCount[0]
     self.testSummaryReady(dataSource)
     
-  def before_send(self, dataSource, data):
-    table, row = data
-    if table.name == ptr.name:
-      self.onPtr(row)
-    elif table.name == mpr.name:
-      self.onMpr(row)
-    elif table.name == ftr.name:
-      self.onFtr(row)
-    elif table.name == tsr.name:
-      self.onTsr(row)
-  
-  def onPtr(self, row):
+  def on_ptr(self, dataSource, row):
     execCount = self.testExecs.setdefault(
       (row[ptr.SITE_NUM], row[ptr.TEST_NUM]), [0])
     execCount[0] += 1
@@ -134,7 +123,7 @@ class TestSummarizer(EventSource):
       limits = self.limitsMap.setdefault(row[ptr.TEST_NUM], set())
       limits.add((loLimit, hiLimit))
   
-  def onMpr(self, row):
+  def on_mpr(self, dataSource, row):
     if row[mpr.TEST_FLG] & 0x80 > 0:
       failCount = self.testFails.setdefault(
         (row[mpr.SITE_NUM], row[mpr.TEST_NUM]), [0])
@@ -160,7 +149,7 @@ class TestSummarizer(EventSource):
       limits = self.limitsMap.setdefault(row[mpr.TEST_NUM], set())
       limits.add((loLimit, hiLimit))
   
-  def onFtr(self, row):
+  def on_ftr(self, dataSource, row):
     if row[ftr.TEST_FLG] & 0x80 > 0:
       countList = self.testFails.setdefault(
         (row[ftr.SITE_NUM], row[ftr.TEST_NUM]), [0])
@@ -184,7 +173,7 @@ class TestSummarizer(EventSource):
     aliases = self.testAliasMap.setdefault(row[ftr.TEST_NUM], set())
     aliases.add((row[ftr.TEST_TXT], self.FTR_TEST_TXT))
   
-  def onTsr(self, row):
+  def on_tsr(self, dataSource, row):
     if row[tsr.HEAD_NUM] == 255:
       self.overallTsrs[row[tsr.TEST_NUM]] = [
         filterNull(value) for value in row]
@@ -17,10 +17,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
-import sys, os
+import sys, os, re
 from time import strftime, localtime
 from xml.sax.saxutils import quoteattr
 from pystdf import V4
+from pystdf.Types import logicalTypeMap
 
 import pdb
 
@@ -98,3 +99,139 @@ class XmlWriter:
     def after_complete(self, dataSource):
         self.stream.write('</Stdf>\n')
         self.stream.flush()
+
+def arrow_type(pa, field_type):
+    """The Arrow type of an STDF field type, after Types.logicalTypeMap"""
+    if field_type[0] == 'k': # An Array of some other type
+        item_type = re.match(r'k\d+([A-Z][a-z0-9]+)', field_type).group(1)
+        return pa.list_(arrow_type(pa, item_type))
+    logical_type = logicalTypeMap.get(field_type)
+    if logical_type in ('Char', 'String'):
+        return pa.string()
+    elif field_type in ('Bn', 'Dn'):
+        return pa.list_(pa.uint8())
+    elif field_type == 'N1': # Nibble arrays are not decoded, always None
+        return pa.uint8()
+    elif logical_type == 'List': # Vn generic data of mixed types
+        return pa.list_(pa.string())
+    return getattr(pa, logical_type.lower())()
+
+class ParquetWriter:
+    """Writes each record type to <directory>/<REC>.parquet, typed after
+    Types.logicalTypeMap.  Records are buffered and written a row group at
+    a time, and string columns are dictionary encoded.  Needs pyarrow."""
+
+    def __init__(self, directory, types=None, row_group_size=65536):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        if types is not None:
+            self.only = set(types)
+
+    def before_begin(self, dataSource):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.rows = {}
+        self.writers = {}
+
+    def after_send(self, dataSource, data):
+        if not data[0].fieldMap:
+            return # Nothing to store for EPS and the like
+        rows = self.rows.get(data[0])
+        if rows is None:
+            rows = self.rows[data[0]] = []
+        rows.append(data[1])
+        if len(rows) >= self.row_group_size:
+            self.write_row_group(data[0])
+
+    def write_row_group(self, rectype):
+        rows = self.rows[rectype]
+        if not rows:
+            return
+        writer = self.writers.get(rectype)
+        if writer is None:
+            schema = self.pa.schema([(name, arrow_type(self.pa, field_type))
+                                     for name, field_type in rectype.fieldMap])
+            strings = [name for name, field_type in rectype.fieldMap if field_type in ('C1', 'Cn')]
+            path = os.path.join(self.directory, rectype.__class__.__name__.upper() + '.parquet')
+            writer = self.writers[rectype] = self.pq.ParquetWriter(path, schema, use_dictionary=strings)
+        columns = []
+        for (name, field_type), values in zip(rectype.fieldMap, zip(*rows)):
+            if field_type == 'Vn':
+                values = [None if value is None else [str(v) for v in value] for value in values]
+            columns.append(self.pa.array(values, writer.schema.field(name).type))
+        writer.write_table(self.pa.Table.from_arrays(columns, schema=writer.schema))
+        self.rows[rectype] = []
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def after_complete(self, dataSource):
+        for rectype in list(self.rows):
+            self.write_row_group(rectype)
+        self.close()
+
+    def after_cancel(self, dataSource, exception):
+        self.close()
+
+class ExcelWriter:
+    """Writes each record type to its own worksheet as the records arrive,
+    with xlsxwriter in constant_memory mode, so rows are flushed to disk as
+    they go instead of being held in memory.  A record type with more rows
+    than a sheet can hold carries on in REC_2, REC_3, ...  Needs
+    xlsxwriter."""
+
+    max_rows = 1048576
+
+    def __init__(self, filename, types=None, na_rep='N/A'):
+        self.filename = filename
+        self.na_rep = na_rep
+        if types is not None:
+            self.only = set(types)
+
+    def before_begin(self, dataSource):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(self.filename, {'constant_memory': True,
+                                                            'nan_inf_to_errors': True})
+        # Same header style as DataFrame.to_excel
+        self.header_format = self.workbook.add_format({'bold': True, 'border': 1,
+                                                       'align': 'center', 'valign': 'top'})
+        self.sheets = {}
+
+    def add_sheet(self, rectype, count):
+        name = rectype.__class__.__name__.upper()
+        if count > 1:
+            name = '%s_%d' % (name, count)
+        worksheet = self.workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, rectype.fieldNames, self.header_format)
+        return [worksheet, 1, count]
+
+    def excel_value(self, value):
+        if value is None:
+            return self.na_rep
+        elif isinstance(value, list):
+            return str(value)
+        return value
+
+    def after_send(self, dataSource, data):
+        rectype, fields = data
+        if not rectype.fieldMap:
+            return # Nothing to store for EPS and the like
+        sheet = self.sheets.get(rectype)
+        if sheet is None:
+            sheet = self.sheets[rectype] = self.add_sheet(rectype, 1)
+        elif sheet[1] >= self.max_rows:
+            sheet = self.sheets[rectype] = self.add_sheet(rectype, sheet[2] + 1)
+        sheet[0].write_row(sheet[1], 0, [self.excel_value(value) for value in fields])
+        sheet[1] += 1
+
+    def after_complete(self, dataSource):
+        self.workbook.close()
+
+    def after_cancel(self, dataSource, exception):
+        self.workbook.close()
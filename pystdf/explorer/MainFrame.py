@@ -24,14 +24,14 @@ import wx.grid
 import wx.gizmos
 from wx.lib.anchors import LayoutAnchors
 
-from pystdf.IO import Parser
+from pystdf.IO import MappedStdf
 from pystdf.Mapping import *
+from pystdf.Progress import ProgressReporter
 from pystdf.Writers import *
 
 from record_pos_table import RecordPositionTable
 from record_pos_listctrl import RecordPositionListCtrl
 from record_view_listctrl import RecordViewListCtrl
-from record_keeper import RecordKeeper
 
 from threading import *
 from pystdf.logexcept import exc_string
@@ -49,20 +49,25 @@ class MappedEvent(wx.PyEvent):
         self.SetEventType(EVT_MAPPED_ID)
         self.cancelled = cancelled
 
-class ProgressUpdater:
-    def __init__(self, notify_window):
+class ProgressUpdater(ProgressReporter):
+    def __init__(self, notify_window, total):
+        ProgressReporter.__init__(self, total=total)
         self.notify_window = notify_window
         self.count = 0
         self.cancelled = False
 
-    def before_send(self, dataSource, data):
+    def before_header(self, dataSource, header):
         if self.cancelled:
             raise MapperCancelled
         self.count += 1
-        if self.count % 1000 == 0:
-            self.notify_window.statusBar.SetStatusText('Mapped %d bytes' % (
-                dataSource.inp.tell()))
-            self.notify_window.recordPositionList.SetItemCount(self.count)
+        ProgressReporter.before_header(self, dataSource, header)
+
+    def report(self, dataSource, percent):
+        # Runs on the mapper thread, so the window is only updated later on
+        # the UI thread; OnMenuFileCloseMenu blocks that thread joining this one
+        wx.CallAfter(self.notify_window.OnMapProgress, self,
+                     'Mapped %d bytes (%d%%)' % (dataSource.recordOffset, percent),
+                     self.count)
 
 class MapperCancelled(Exception): pass
 
@@ -71,7 +76,7 @@ class MapperThread(Thread):
         Thread.__init__(self)
         self._notify_window = notify_window
         self.parser = parser
-        self.progress_updater = ProgressUpdater(notify_window)
+        self.progress_updater = ProgressUpdater(notify_window, len(parser.view))
         self.parser.addSink(self.progress_updater)
         self.start()
 
@@ -226,7 +231,8 @@ class MainFrame(wx.Frame):
 
     def __init__(self, parent):
         self._init_ctrls(parent)
-        self.view_stream = None
+        self.stdf = None
+        self.mapper = None
         EVT_MAPPED(self, self.OnMapped)
 
     def OnMenuHelpAboutMenu(self, event):
@@ -238,29 +244,43 @@ class MainFrame(wx.Frame):
             if dlg.ShowModal() == wx.ID_OK:
                 filename = dlg.GetPath()
 
-                # Set up the mapping parser
-                self.map_stream = open(filename, 'rb')
-                parser = Parser(inp=self.map_stream)
-                self.record_mapper = StreamMapper()
-                parser.addSink(self.record_mapper)
-                material_mapper = MaterialMapper()
-                parser.addSink(material_mapper)
-                self.recordPositionList.record_mapper = self.record_mapper
-                self.recordPositionList.material_mapper = material_mapper
-
-                # Set up the viewing parser
-                self.view_stream = open(filename, 'rb')
-                self.view_parser = Parser(inp=self.view_stream)
-                self.record_keeper = RecordKeeper()
-                self.view_parser.addSink(self.record_keeper)
-                self.view_parser.parse(1)
-
-                # Parse the file in a separate thread
-                self.mapper = MapperThread(self, parser)
+                # One memory-mapped reader serves both the mapping pass
+                # and the records fetched when browsing
+                self.stdf = MappedStdf(filename)
+                self.stdf_key = RecordIndex.fileKey(filename)
+                self.stdf_name = filename
+
+                # Reuse the sidecar index when the file has not changed
+                index = RecordIndex.load(filename)
+                if index is not None:
+                    self.record_mapper = index
+                    self.recordPositionList.record_mapper = index
+                    self.recordPositionList.material_mapper = index
+                    self.statusBar.SetStatusText('Loaded %s' % (
+                        RecordIndex.filenameFor(filename)))
+                    return
+
+                index_mapper = IndexMapper()
+                self.stdf.addSink(index_mapper)
+                self.record_mapper = index_mapper.index
+                self.recordPositionList.record_mapper = index_mapper.index
+                self.recordPositionList.material_mapper = index_mapper.index
+
+                # Parse the file in a separate thread.  The decoders are set up
+                # first, so the thread does not change them under record_at()
+                self.stdf.detectMappedEndian()
+                self.mapper = MapperThread(self, self.stdf)
 
         finally:
             dlg.Destroy()
 
+    def OnMapProgress(self, progress_updater, text, count):
+        # Updates queued by a mapper that has since been closed are dropped
+        if self.mapper is None or self.mapper.progress_updater is not progress_updater:
+            return
+        self.statusBar.SetStatusText(text)
+        self.recordPositionList.SetItemCount(count)
+
     def OnMapped(self, event):
         if event.cancelled:
             self.statusBar.SetStatusText('%s... Cancelled!' % (
@@ -270,18 +290,22 @@ class MainFrame(wx.Frame):
                 len(self.record_mapper.indexes))
             self.statusBar.SetStatusText('%s... Done' % (
                 self.statusBar.GetStatusText()))
-
-        if self.map_stream is not None:
-            self.map_stream.close()
-            self.map_stream = None
+            try:
+                self.record_mapper.save(self.stdf_name, self.stdf_key)
+            except (IOError, OSError):
+                pass
         self.mapper = None
 
     def OnMenuFileCloseMenu(self, event):
+        if self.mapper:
+            self.mapper.cancel()
+            self.mapper.join()
+            self.mapper = None
+
         self.recordPositionList.record_mapper = None
         self.recordPositionList.material_mapper = None
-        self.view_stream.close()
-        self.view_stream = None
-        self.view_parser = None
+        self.stdf.close()
+        self.stdf = None
         self.record_mapper = None
 
         self.recordPositionList.SetItemCount(0)
@@ -289,14 +313,10 @@ class MainFrame(wx.Frame):
         self.recordViewList.SetItemCount(0)
         self.recordViewList.Refresh()
 
-        if self.mapper:
-            self.mapper.cancel()
-
     def OnMenuFileExitMenu(self, event):
         self.Close()
 
     def OnRecordPositionListListItemSelected(self, event):
         if self.record_mapper:
-            self.view_stream.seek(self.record_mapper.indexes[event.GetIndex()])
-            self.view_parser.parse(1)
-            self.recordViewList.record = self.record_keeper.record_type, self.record_keeper.record_data
+            self.recordViewList.record = self.stdf.record_at(
+                self.record_mapper.indexes[event.GetIndex()])
@@ -1,17 +1,31 @@
 # -*- coding:utf-8 -*-
+import numpy as np
 import pandas as pd
 from abc import ABC
+from array import array
+import csv
 import time
 import gzip
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
+from itertools import islice
+from multiprocessing import Manager
+from queue import Empty
 
 from pystdf.IO import Parser
+from pystdf.Parallel import iterParallelParse
+from pystdf.Progress import ProgressReporter
 import pystdf.V4 as V4
 from pystdf.Writers import *
-from pystdf.Importer import STDF2DataFrame
+from pystdf.Importer import STDF2Parquet, STDF2Excel
 
 
 class FileReaders(ABC):
+    # Largest piece of a file profile_file hands to one worker process
+    range_bytes = 1 << 26
+
     # This function is to parse STDF into an ATDF like log, abandon this part now
     @staticmethod
     def process_file(filename):
@@ -41,90 +55,134 @@ class FileReaders(ABC):
         print('STDF processing time：', endt - startt)
 
     @staticmethod
-    def to_csv(file_names, output_file_name, notify_progress_bar):
-
-        data_summary_all = pd.DataFrame()
-        for filename in file_names:
-            # Open std file/s
-            if filename.endswith(".std") or filename.endswith(".stdf"):
-                f = open(filename, 'rb')
-            elif filename.endswith(".gz"):
-                f = gzip.open(filename, 'rb')
+    def to_csv(file_names, output_file_name, notify_progress_bar, workers=None, numeric=True):
+
+        # Die rows are streamed into the csv file as they are produced, so
+        # memory does not grow with the number of files
+        writer = TestMatrixCsvWriter(output_file_name + ".csv")
+        if len(file_names) > 1 and workers != 1:
+            # One worker process per file, each frame is written as soon as it is its turn
+            for frame, flags in FileReaders.profile_files(file_names, notify_progress_bar, workers, numeric):
+                writer.writeFrame(frame, flags)
+        else:
+            for filename in file_names:
+                frame, flags = FileReaders.profile_file(filename, notify_progress_bar, workers, numeric, writer)
+                writer.writeFrame(frame, flags)
+        writer.close()
+
+    @staticmethod
+    def profile_file(filename, notify_progress_bar, workers=1, numeric=True, writer=None):
+        """Parse one STDF file with MyTestResultProfiler, returns its frame
+        and pass/fail flags.  With workers > 1 the file is split at touchdowns
+        and the pieces are parsed in that many processes.  Given a
+        TestMatrixCsvWriter, the rows are streamed into it and empty frames
+        are returned."""
+        # Open std file/s
+        if filename.endswith(".std") or filename.endswith(".stdf"):
+            f = open(filename, 'rb')
+        elif filename.endswith(".gz"):
+            f = gzip.open(filename, 'rb')
+        fsize = os.path.getsize(filename)
+        fname = filename  # + "_csv_log.csv"
+        startt = time.time()  # 9.7s --> TextWriter; 7.15s --> MyTestResultProfiler
+
+        if workers is not None and workers > 1 and not filename.endswith(".gz"):
+            # Split the file at touchdown boundaries and parse the pieces in worker processes,
+            # in pieces of at most range_bytes so only a few are held at a time
+            f.close()
+            parts = max(workers, fsize // FileReaders.range_bytes)
+            parsed = FileReaders.report_ranges(iterParallelParse(
+                filename, partial(MyTestResultProfiler, fname, None, fsize, None, numeric), workers, parts),
+                fsize, notify_progress_bar)
+            data_summary = MyTestResultProfiler(filename=fname, file=None, filezise=fsize,
+                                                notify_progress_bar=notify_progress_bar, numeric=numeric)
+            if writer is not None:
+                # Each range is written as soon as it is its turn, BIN_DESC is filled in at the end
+                sbin_description = {}
+                for profiler, frame, flags in MyTestResultProfiler.merge_ranges(parsed):
+                    sbin_description.update(profiler.sbin_description)
+                    writer.writeFrame(frame, flags, pending=True)
+                writer.endFile(sbin_description)
+            else:
+                parsed = list(parsed)
+                data_summary.frame, data_summary.flags = MyTestResultProfiler.merge(
+                    [file_range for file_range, profiler in parsed], [profiler for file_range, profiler in parsed])
+        else:
             p = Parser(inp=f, reopen_fn=None)
             print("parse",p)
-            fsize = os.path.getsize(filename)
-            fname = filename  # + "_csv_log.csv"
-            startt = time.time()  # 9.7s --> TextWriter; 7.15s --> MyTestResultProfiler
 
             # Writing to a text file instead of vomiting it to the console
-            data_summary = MyTestResultProfiler(filename=fname,file=f, filezise = fsize, notify_progress_bar=notify_progress_bar)
+            data_summary = MyTestResultProfiler(filename=fname,file=f, filezise = fsize, notify_progress_bar=notify_progress_bar,
+                                                numeric=numeric, writer=writer)
             print(data_summary)
             p.addSink(data_summary)
+            if notify_progress_bar is not None:
+                p.addSink(ProgressReporter(notify_progress_bar.emit, fsize))
             p.parse()
-            endt = time.time()
-            print('STDF processing time：', endt - startt)
+            f.close()
+        endt = time.time()
+        print('STDF processing time：', endt - startt)
+        return data_summary.frame, data_summary.flags
 
-            # data_summary_all = data_summary_all.append(data_summary.frame)
-            # data_summary_all = pd.concat([data_summary_all,data_summary.frame],sort=False,join='outer')
-            if data_summary_all.empty:
-                data_summary_all = data_summary.frame
-            else:
-                # data_summary_all = pd.merge(data_summary_all, data_summary.frame, sort=False, how='outer')
-                data_summary_all = pd.concat([data_summary_all, data_summary.frame], sort=False,
-                                             join='outer', ignore_index=True)
+    @staticmethod
+    def report_ranges(parsed, fsize, notify_progress_bar):
+        # Pass (FileRange, profiler) pairs through, showing how far into the file they got
+        for file_range, profiler in parsed:
+            if notify_progress_bar is not None:
+                notify_progress_bar.emit(min(100, file_range.stop * 100 // fsize))
+            yield file_range, profiler
 
-        # Set multiple level columns for csv table
-        tname_list = []
-        tnumber_list = []
-        hilimit_list = []
-        lolimit_list = []
-        unit_vect_nam_list = []
-        tmplist = data_summary_all.columns.values.tolist()
-        for i in range(len(tmplist)):
-            if len(str(tmplist[i]).split('|')) == 1:
-                tname_list.append('')
-                tnumber_list.append(str(tmplist[i]).split('|')[0])
-                hilimit_list.append('')
-                lolimit_list.append('')
-                unit_vect_nam_list.append('')
-            else:
-                tname_list.append(str(tmplist[i]).split('|')[1])
-                tnumber_list.append(str(tmplist[i]).split('|')[0])
-                hilimit_list.append(str(tmplist[i]).split('|')[2])
-                lolimit_list.append(str(tmplist[i]).split('|')[3])
-                unit_vect_nam_list.append(str(tmplist[i]).split('|')[4])
-        data_summary_all.columns = [tname_list, hilimit_list, lolimit_list, unit_vect_nam_list, tnumber_list]
-        data_summary_all.to_csv(output_file_name + ".csv", index=False)
-        path = 'output.txt'
-        with open(path, 'a') as f:
-            f.write(data_summary.frame)
+    @staticmethod
+    def profile_files(file_names, notify_progress_bar, workers=None, numeric=True):
+        """Parse every file in its own worker process, yields the frames and
+        flags in file order as they become available.  The progress bar shows
+        the mean progress of all files."""
+        progress = [0] * len(file_names)
+        with Manager() as manager, ProcessPoolExecutor(workers) as pool:
+            queue = manager.Queue()
+            futures = [pool.submit(FileReaders.profile_file, filename, QueueProgress(queue, index), 1, numeric)
+                       for index, filename in enumerate(file_names)]
+            indices = dict((future, index) for index, future in enumerate(futures))
+            pending = set(futures)
+            next_index = 0
+            while pending:
+                done, pending = wait(pending, timeout=0.2)
+                while True:
+                    try:
+                        index, value = queue.get_nowait()
+                    except Empty:
+                        break
+                    progress[index] = max(progress[index], value)
+                for future in done:
+                    progress[indices.pop(future)] = 100
+                if notify_progress_bar is not None:
+                    notify_progress_bar.emit(sum(progress) // len(progress))
+                while next_index < len(futures) and futures[next_index].done():
+                    yield futures[next_index].result()
+                    futures[next_index] = None
+                    next_index += 1
 
     @staticmethod
     def to_excel(filename):
+        # Rows are written into the sheets as the records are parsed, no DataFrames
+        # in between; a record type past the sheet row limit continues in REC_2, ...
+        startt = time.time()
+        fname = STDF2Excel(filename)
+        endt = time.time()
+        print('STDF processing time：', endt - startt)
+        return fname
 
-        tables = STDF2DataFrame(filename)
-        # The name of the new file, preserving the directory of the previous
-        fname = filename + ".xlsx"
-        # Writing object to work with excel documents
-        writer = pd.ExcelWriter(fname, engine='xlsxwriter')
-
-        # Not mine and I don't really know what's going on here, but it works, so I won't question him.
-        # It actually write the data frame as an excel document
-        for k, v in tables.items():
-            # Make sure the order of columns complies the specs
-            record = [r for r in V4.records if r.__class__.__name__.upper() == k]
-            if len(record) == 0:
-                print("Ignore exporting table %s: No such record type exists." % k)
-            else:
-                columns = [field[0] for field in record[0].fieldMap]
-                if len(record[0].fieldMap) > 0:
-                    v.to_excel(writer, sheet_name=k, columns=columns,
-                               index=False, na_rep="N/A")
-
-        writer.save()
+    @staticmethod
+    def to_parquet(filename):
+        # One Parquet file per record type in <filename>_parquet, no row limit unlike the excel sheets
+        startt = time.time()
+        directory = STDF2Parquet(filename)
+        endt = time.time()
+        print('STDF processing time：', endt - startt)
+        return directory
 
     @staticmethod
-    def to_ASCII(filename):
+    def profile_scan(filename):
         # Open std file/s
         if filename.endswith(".std") or filename.endswith(".stdf"):
             f = open(filename, 'rb')
@@ -141,14 +199,30 @@ class FileReaders(ABC):
         stdf_df = My_STDF_V4_2007_1_Profiler(filename)
         p.addSink(stdf_df)
         p.parse()
+        f.close()
 
         endt = time.time()
         print('STDF processing time：', endt - startt)
+        return stdf_df
 
+    @staticmethod
+    def to_ASCII(filename):
+        stdf_df = FileReaders.profile_scan(filename)
         stdf_df.all_test_result_pd.to_csv(filename + "_diag_log.csv", index=False)
 
+    @staticmethod
+    def to_diag_parquet(filename):
+        # Same fail log as to_ASCII, but each part is stored once in parts.parquet and
+        # the fail cycles as typed columns in fails.parquet, with pin/pattern names
+        # dictionary encoded
+        stdf_df = FileReaders.profile_scan(filename)
+        return stdf_df.fail_log.writeParquet(filename + "_diag_log", stdf_df.pmr_dict,
+                                             stdf_df.pat_nam_dict, stdf_df.mod_nam_dict)
+
 # Get the test time, small case from pystdf
 class MyTestTimeProfiler:
+    only = set([V4.prr])
+
     def __init__(self):
         self.total = 0
         self.count = 0
@@ -171,16 +245,265 @@ class MyTestTimeProfiler:
             print("No test time samples found :(")
 
 
+class QueueProgress:
+    # Takes the place of the progress bar signal in a worker process, forwarding
+    # (file index, percent) to the parent whenever the percentage changes
+    def __init__(self, queue, index):
+        self.queue = queue
+        self.index = index
+        self.last = None
+
+    def emit(self, value):
+        if value != self.last:
+            self.last = value
+            self.queue.put((self.index, value))
+
+
+class TestResultBuilder:
+    # Collects the touchdowns of MyTestResultProfiler column by column, so the
+    # DataFrame is built once at the end instead of appended to part by part.
+    # Numeric result columns are float32 arrays with a parallel uint8 array of
+    # flags: FAIL for a failed test, NO_TEST where the part has no result for the
+    # test and NO_RESULT where its record had no RESULT, which str() made 'None'.
+    FAIL = 1
+    NO_TEST = 2
+    NO_RESULT = 4
+
+    def __init__(self):
+        self.index = {}    # column name -> position in self.columns
+        self.names = []
+        self.columns = []
+        self.flags = {}    # numeric column name -> flags
+        self.rows = 0
+
+    def column(self, name, numeric=False):
+        position = self.index.get(name)
+        if position is None:
+            position = self.index[name] = len(self.columns)
+            self.names.append(name)
+            if numeric:
+                self.columns.append(array('f'))
+                self.flags[name] = array('B')
+            else:
+                self.columns.append([])
+        return self.columns[position]
+
+    def pad(self, name, column, rows):
+        missing = rows - len(column)
+        if missing > 0:
+            if name in self.flags:
+                column.extend([np.nan] * missing)
+                self.flags[name].extend(bytes([self.NO_TEST]) * missing)
+            else:
+                column.extend([None] * missing)
+
+    def addTouchdown(self, results, flags=None):
+        # results maps column names to the values of the parts of one touchdown,
+        # flags maps the numeric columns among them to their pass/fail flags
+        flags = flags or {}
+        rows = max([len(values) for values in results.values()] + [0])
+        for name, values in results.items():
+            test_flags = flags.get(name)
+            column = self.column(name, test_flags is not None)
+            self.pad(name, column, self.rows)
+            if test_flags is None:
+                column.extend(values)
+            else:
+                column.extend([np.nan if value is None else value for value in values])
+                self.flags[name].extend(test_flags)
+            self.pad(name, column, self.rows + rows)
+        self.rows += rows
+
+    def frame(self):
+        data = {}
+        for name, column in zip(self.names, self.columns):
+            self.pad(name, column, self.rows)
+            if name in self.flags:
+                data[name] = np.array(column, dtype=np.float32)
+            else:
+                data[name] = np.array(column, dtype=object)
+        return pd.DataFrame(data, columns=self.names, index=pd.RangeIndex(self.rows))
+
+    def flagFrame(self):
+        names = [name for name in self.names if name in self.flags]
+        data = dict((name, np.array(self.flags[name], dtype=np.uint8)) for name in names)
+        return pd.DataFrame(data, columns=names, index=pd.RangeIndex(self.rows))
+
+
+class TestMatrixCsvWriter:
+    # Writes the per-die test matrix of FileReaders.to_csv. Rows are written to a
+    # temporary spool as the touchdowns come in, in the column order known so far.
+    # close() writes the five header rows and copies the spool behind them in a
+    # second pass, padding rows written before later tests appeared and filling in
+    # BIN_DESC from the SBRs, which only come at the end of each file.
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}    # column name -> position
+        self.names = []
+        self.spool = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.spool, lineterminator=os.linesep)
+        self.segments = []    # [rows, columns, sbin_description], in spool order
+        self.file_start = 0
+
+    def column(self, name):
+        position = self.index.get(name)
+        if position is None:
+            position = self.index[name] = len(self.names)
+            self.names.append(name)
+        return position
+
+    def addSegment(self, rows, pending):
+        # pending rows get their BIN_DESC when their file ends
+        last = self.segments[-1] if len(self.segments) > self.file_start else None
+        if last is not None and last[1] == len(self.names) and (last[2] is None) != pending:
+            last[0] += rows
+        else:
+            self.segments.append([rows, len(self.names), {} if pending else None])
+
+    def addTouchdown(self, results, flags=None):
+        # Same arguments as TestResultBuilder.addTouchdown
+        flags = flags or {}
+        rows = max([len(values) for values in results.values()] + [0])
+        positions = [self.column(name) for name in results]
+        lines = [[''] * len(self.names) for row in range(rows)]
+        for position, (name, values) in zip(positions, results.items()):
+            test_flags = flags.get(name)
+            for row, value in enumerate(values):
+                if test_flags is not None:
+                    value = MyTestResultProfiler.render_result(value, test_flags[row])
+                if value is None:
+                    continue
+                lines[row][position] = value
+        self.writer.writerows(lines)
+        self.addSegment(rows, True)
+
+    def writeFrame(self, frame, flags, chunk_rows=10000, pending=False):
+        # A finished frame, BIN_DESC already filled in unless pending
+        if frame.empty:
+            return
+        for name in frame.columns:
+            self.column(name)
+        for start in range(0, len(frame), chunk_rows):
+            chunk = MyTestResultProfiler.render_results(frame.iloc[start:start + chunk_rows],
+                                                        flags.iloc[start:start + chunk_rows])
+            chunk.reindex(columns=self.names).to_csv(self.spool, header=False, index=False)
+        self.addSegment(len(frame), pending)
+
+    def endFile(self, sbin_description):
+        for segment in self.segments[self.file_start:]:
+            if segment[2] is not None:
+                segment[2] = sbin_description
+        self.file_start = len(self.segments)
+
+    def close(self):
+        # Set multiple level columns for csv table
+        tname_list = []
+        tnumber_list = []
+        hilimit_list = []
+        lolimit_list = []
+        unit_vect_nam_list = []
+        for name in self.names:
+            if len(str(name).split('|')) == 1:
+                tname_list.append('')
+                tnumber_list.append(str(name).split('|')[0])
+                hilimit_list.append('')
+                lolimit_list.append('')
+                unit_vect_nam_list.append('')
+            else:
+                tname_list.append(str(name).split('|')[1])
+                tnumber_list.append(str(name).split('|')[0])
+                hilimit_list.append(str(name).split('|')[2])
+                lolimit_list.append(str(name).split('|')[3])
+                unit_vect_nam_list.append(str(name).split('|')[4])
+
+        soft_bin = self.index.get('SOFT_BIN')
+        bin_desc = self.index.get('BIN_DESC')
+        self.spool.seek(0)
+        reader = csv.reader(self.spool)
+        with open(self.filename, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator=os.linesep)
+            writer.writerows([tname_list, hilimit_list, lolimit_list, unit_vect_nam_list, tnumber_list])
+            for rows, columns, sbin_description in self.segments:
+                padding = [''] * (len(self.names) - columns)
+                for line in islice(reader, rows):
+                    if sbin_description is not None and line[soft_bin] != '':
+                        line[bin_desc] = sbin_description.get(int(line[soft_bin]), line[soft_bin])
+                    writer.writerow(line + padding)
+        self.spool.close()
+
+
+class TestCatalog:
+    # Interns the PTR/MPR/FTR result columns of MyTestResultProfiler. A test gets
+    # a dense column id the first time it is seen and its column name, built from
+    # the normalized name and the limits of that record, is cached, so later
+    # records cost one tuple-keyed lookup.
+    def __init__(self):
+        self.ids = {}                  # (TEST_NUM, TEST_TXT[, pin or VECT_NAM]) -> column id
+        self.names = []                # column id -> 'TEST_NUM|name|HI_LIMIT|LO_LIMIT|UNITS'
+        self.tname_tnumber_dict = {}   # 'TEST_NUM|name' -> column name
+        self.tname_tnumber_ids = {}    # 'TEST_NUM|name' -> column id
+
+    def add(self, tname_tnumber, full_tname_tnumber):
+        column_id = self.tname_tnumber_ids.get(tname_tnumber)
+        if column_id is None:
+            column_id = self.tname_tnumber_ids[tname_tnumber] = len(self.names)
+            self.tname_tnumber_dict[tname_tnumber] = full_tname_tnumber
+            self.names.append(full_tname_tnumber)
+        return column_id
+
+    def ptr(self, fields):
+        key = (fields[V4.ptr.TEST_NUM], fields[V4.ptr.TEST_TXT])
+        column_id = self.ids.get(key)
+        if column_id is None:
+            # get rid of channel number in TName, so that the csv file would not split the sites data into different columns
+            tname_list = fields[V4.ptr.TEST_TXT].split(' ')
+            if len(tname_list) == 5:
+                tname_list.pop(2) #remove channel number
+            tname_tnumber = str(fields[V4.ptr.TEST_NUM]) + '|' + ' '.join(tname_list)
+            # RES_SCAL is meaningless in IG-XL STDF, UNITS is used as is
+            column_id = self.ids[key] = self.add(tname_tnumber, tname_tnumber + '|' +
+                                                 str(fields[V4.ptr.HI_LIMIT]) + '|' +
+                                                 str(fields[V4.ptr.LO_LIMIT]) + '|' +
+                                                 str(fields[V4.ptr.UNITS]))
+        return column_id
+
+    def mpr(self, fields, pin):
+        key = (fields[V4.mpr.TEST_NUM], fields[V4.mpr.TEST_TXT], pin)
+        column_id = self.ids.get(key)
+        if column_id is None:
+            tname_tnumber = str(fields[V4.mpr.TEST_NUM]) + '|' + fields[V4.mpr.TEST_TXT] + '@' + pin
+            column_id = self.ids[key] = self.add(tname_tnumber, tname_tnumber + '|' +
+                                                 str(fields[V4.mpr.HI_LIMIT]) + '|' +
+                                                 str(fields[V4.mpr.LO_LIMIT]) + '|' +
+                                                 str(fields[V4.mpr.UNITS]))
+        return column_id
+
+    def ftr(self, fields):
+        key = (fields[V4.ftr.TEST_NUM], fields[V4.ftr.TEST_TXT], fields[V4.ftr.VECT_NAM], None)
+        column_id = self.ids.get(key)
+        if column_id is None:
+            column_id = self.ids[key] = len(self.names)
+            self.names.append(str(fields[V4.ftr.TEST_NUM]) + '|' + fields[V4.ftr.TEST_TXT] + '|-1|-1|' +
+                              fields[V4.ftr.VECT_NAM])
+        return column_id
+
+
 # Get all PTR,PIR,FTR result
 class MyTestResultProfiler:
-    def __init__(self, filename, file, filezise, notify_progress_bar):
+    # numeric=True keeps PTR/MPR results as float32 with a frame of
+    # TestResultBuilder flags in self.flags; render_results turns them back into the '(F)' text
+    def __init__(self, filename, file, filezise, notify_progress_bar, numeric=False, writer=None):
         self.filename = filename
+        self.numeric = numeric
+        self.writer = writer    # a TestMatrixCsvWriter to stream the touchdowns into
         self.reset_flag = False
         self.total = 0
         self.count = 0
         self.site_count = 0
         self.site_array = []
+        self.site_slots = {}    # SITE_NUM -> slots in site_array
         self.test_result_dict = {}
+        self.test_flag_dict = {}
 
         self.file_nam = self.filename.split('/')[-1]
         self.tester_nam = ''
@@ -191,17 +514,21 @@ class MyTestResultProfiler:
         self.job_nam = ''
         self.exec_type = '' #IG-XL or 93000
 
-        self.tname_tnumber_dict = {}
+        self.catalog = TestCatalog()
+        self.tname_tnumber_dict = self.catalog.tname_tnumber_dict
         self.sbin_description = {}
-        self.DIE_ID = []
+        self.DIE_ID = set()    # (PGM_NAM, X_COORD, Y_COORD) tested on this wafer
         self.lastrectype = None
         self.pmr_dict = {}
+        self.wir_rows = []
 
         #for MPR
         self.mpr_pin_list = []
 
+        self.results = TestResultBuilder()
         self.all_test_result_pd = pd.DataFrame()
         self.frame = pd.DataFrame()
+        self.flags = pd.DataFrame()
 
         self.file = file #io.BytesIO(b'')
         self.filezise = filezise
@@ -213,13 +540,17 @@ class MyTestResultProfiler:
         self.count = 0
         self.site_count = 0
         self.site_array = []
+        self.site_slots = {}    # SITE_NUM -> slots in site_array
         self.test_result_dict = {'FILE_NAM': [], 'TESTER_NAM': [], 'START_T': [], 'PGM_NAM': [],
                                  'JOB_NAM': [], 'LOT_ID': [], 'WAFER_ID': [], 'SITE_NUM': [],
                                  'X_COORD': [], 'Y_COORD': [], 'PART_ID': [], 'RC': [],
                                  'HARD_BIN': [], 'SOFT_BIN': [], 'BIN_DESC': [], 'TEST_T': []}
+        self.test_flag_dict = {}
 
+        self.results = TestResultBuilder()
         self.all_test_result_pd = pd.DataFrame()
         self.frame = pd.DataFrame()
+        self.flags = pd.DataFrame()
 
         self.file_nam = self.filename.split('/')[-1]
         self.tester_nam = ''
@@ -230,11 +561,13 @@ class MyTestResultProfiler:
         self.job_nam = ''
         self.exec_type = ''
 
-        self.tname_tnumber_dict = {}
+        self.catalog = TestCatalog()
+        self.tname_tnumber_dict = self.catalog.tname_tnumber_dict
         self.sbin_description = {}
-        self.DIE_ID = []
+        self.DIE_ID = set()    # (PGM_NAM, X_COORD, Y_COORD) tested on this wafer
         self.lastrectype = None
         self.pmr_dict = {}
+        self.wir_rows = []
 
         #for MPR
         self.mpr_pin_list = []
@@ -251,7 +584,9 @@ class MyTestResultProfiler:
             self.exec_type = str(fields[V4.mir.EXEC_TYP])
         if rectype == V4.wir:
             self.wafer_id = str(fields[V4.wir.WAFER_ID])
-            self.DIE_ID = []
+            self.DIE_ID = set()
+            # Remember where the retest history was reset, for merge()
+            self.wir_rows.append((dataSource.recordOffset, self.results.rows))
         if rectype == V4.pmr:
             if self.exec_type == '93000':
                 self.pmr_dict[str(fields[V4.pmr.PMR_INDX])] = str(fields[V4.pmr.CHAN_NAM])
@@ -264,79 +599,42 @@ class MyTestResultProfiler:
                 self.reset_flag = False
                 self.site_count = 0
                 self.site_array = []
+                self.site_slots = {}
                 # self.all_test_result_pd = self.all_test_result_pd.append(pd.DataFrame(self.test_result_dict))
                 self.test_result_dict = {'FILE_NAM': [], 'TESTER_NAM': [], 'START_T': [], 'PGM_NAM': [],
                                          'JOB_NAM': [], 'LOT_ID': [], 'WAFER_ID': [], 'SITE_NUM': [],
                                          'X_COORD': [], 'Y_COORD': [], 'PART_ID': [], 'RC': [],
                                          'HARD_BIN': [], 'SOFT_BIN': [], 'BIN_DESC': [], 'TEST_T': []}
+                self.test_flag_dict = {}
 
+            self.site_slots.setdefault(fields[V4.pir.SITE_NUM], []).append(self.site_count)
             self.site_count += 1
             self.site_array.append(fields[V4.pir.SITE_NUM])
             self.test_result_dict['SITE_NUM'] = self.site_array
         if rectype == V4.bps:
             self.pgm_nam = str(fields[V4.bps.SEQ_NAME])
         if rectype == V4.ptr:  # and fields[V4.prr.SITE_NUM]:
-            # get rid of channel number in TName, so that the csv file would not split the sites data into different columns
-            tname = fields[V4.ptr.TEST_TXT]
-            tname_list = tname.split(' ')
-            if len(tname_list) == 5:
-                tname_list.pop(2) #remove channel number
-            tname = ' '.join(tname_list)
-            tname_tnumber = str(fields[V4.ptr.TEST_NUM]) + '|' + tname #fields[V4.ptr.TEST_TXT]
-
-            # Process the scale unit, but meanless in IG-XL STDF, comment it
-            unit = str(fields[V4.ptr.UNITS])
-            val_scal = fields[V4.ptr.RES_SCAL]
-            # if val_scal == 0:
-            #     unit = unit
-            # elif val_scal == 2:
-            #     unit = '%' + unit
-            # elif val_scal == 3:
-            #     unit = 'm' + unit
-            # elif val_scal == 6:
-            #     unit = 'u' + unit
-            # elif val_scal == 9:
-            #     unit = 'n' + unit
-            # elif val_scal == 12:
-            #     unit = 'p' + unit
-            # elif val_scal == 15:
-            #     unit = 'f' + unit
-            # elif val_scal == -3:
-            #     unit = 'K' + unit
-            # elif val_scal == -6:
-            #     unit = 'M' + unit
-            # elif val_scal == -9:
-            #     unit = 'G' + unit
-            # elif val_scal == -12:
-            #     unit = 'T' + unit
-
-            if not (tname_tnumber in self.tname_tnumber_dict):
-                self.tname_tnumber_dict[tname_tnumber] = str(fields[V4.ptr.TEST_NUM]) + '|' + \
-                                                         tname + '|' + \
-                                                         str(fields[V4.ptr.HI_LIMIT]) + '|' + \
-                                                         str(fields[V4.ptr.LO_LIMIT]) + '|' + \
-                                                         unit #str(fields[V4.ptr.UNITS])
-            # Be careful here, Hi/Low limit only stored in first PTR
-            # tname_tnumber = str(fields[V4.ptr.TEST_NUM]) + '|' + fields[V4.ptr.TEST_TXT] + '|' + \
-            #                 str(fields[V4.ptr.HI_LIMIT]) + '|' + str(fields[V4.ptr.LO_LIMIT]) + '|' + \
-            #                 str(fields[V4.ptr.UNITS])
-            current_tname_tnumber = str(fields[V4.ptr.TEST_NUM]) + '|' + tname #fields[V4.ptr.TEST_TXT]
-            full_tname_tnumber = self.tname_tnumber_dict[current_tname_tnumber]
+            # Be careful here, Hi/Low limit only stored in first PTR, the catalog keeps them
+            full_tname_tnumber = self.catalog.names[self.catalog.ptr(fields)]
             if not (full_tname_tnumber in self.test_result_dict):
                 self.test_result_dict[full_tname_tnumber] = [None] * self.site_count
+                if self.numeric:
+                    self.test_flag_dict[full_tname_tnumber] = [TestResultBuilder.NO_TEST] * self.site_count
             else:
                 pass
                 # if len(self.test_result_dict[full_tname_tnumber]) >= self.site_count:
                 #     # print('Duplicate test number found for test: ', tname_tnumber)
                 #     return
 
-            for i in range(self.site_count):
-                if fields[V4.ptr.SITE_NUM] == self.test_result_dict['SITE_NUM'][i]:
-                    if fields[V4.ptr.TEST_FLG] == 0:
-                        ptr_result = str(fields[V4.ptr.RESULT])
-                    else:
-                        ptr_result = str(fields[V4.ptr.RESULT]) + '(F)'
-                    self.test_result_dict[full_tname_tnumber][i] = ptr_result
+            for i in self.site_slots.get(fields[V4.ptr.SITE_NUM], ()):
+                if self.numeric:
+                    ptr_result = fields[V4.ptr.RESULT]
+                    self.test_flag_dict[full_tname_tnumber][i] = self.numeric_flag(fields[V4.ptr.TEST_FLG], ptr_result)
+                elif fields[V4.ptr.TEST_FLG] == 0:
+                    ptr_result = str(fields[V4.ptr.RESULT])
+                else:
+                    ptr_result = str(fields[V4.ptr.RESULT]) + '(F)'
+                self.test_result_dict[full_tname_tnumber][i] = ptr_result
 
         # This is multiple-result parametric record for a single limit for all the multiple test results
         if rectype == V4.mpr:
@@ -348,65 +646,32 @@ class MyTestResultProfiler:
                 tmp_pin_list = self.mpr_pin_list
 
             tmp_RSLT_list = fields[V4.mpr.RTN_RSLT]
-            tname = fields[V4.mpr.TEST_TXT]
-
-            # Process the scale unit, but meanless in IG-XL STDF, comment it
-            unit = str(fields[V4.mpr.UNITS])
-            # val_scal = fields[V4.mpr.RES_SCAL]
-            # if val_scal == 0:
-            #     unit = unit
-            # elif val_scal == 2:
-            #     unit = '%' + unit
-            # elif val_scal == 3:
-            #     unit = 'm' + unit
-            # elif val_scal == 6:
-            #     unit = 'u' + unit
-            # elif val_scal == 9:
-            #     unit = 'n' + unit
-            # elif val_scal == 12:
-            #     unit = 'p' + unit
-            # elif val_scal == 15:
-            #     unit = 'f' + unit
-            # elif val_scal == -3:
-            #     unit = 'K' + unit
-            # elif val_scal == -6:
-            #     unit = 'M' + unit
-            # elif val_scal == -9:
-            #     unit = 'G' + unit
-            # elif val_scal == -12:
-            #     unit = 'T' + unit
 
             for i in range(len(tmp_pin_list)):
-                tname_pinname = tname + '@' + tmp_pin_list[i]
-                tname_tnumber = str(fields[V4.mpr.TEST_NUM]) + '|' + tname_pinname
-                if not (tname_tnumber in self.tname_tnumber_dict):
-                    self.tname_tnumber_dict[tname_tnumber] = str(fields[V4.mpr.TEST_NUM]) + '|' + \
-                                                             tname_pinname + '|' + \
-                                                             str(fields[V4.mpr.HI_LIMIT]) + '|' + \
-                                                             str(fields[V4.mpr.LO_LIMIT]) + '|' + \
-                                                             unit
-                current_tname_tnumber = str(fields[V4.mpr.TEST_NUM]) + '|' + tname_pinname
-                full_tname_tnumber = self.tname_tnumber_dict[current_tname_tnumber]
+                full_tname_tnumber = self.catalog.names[self.catalog.mpr(fields, tmp_pin_list[i])]
                 if not (full_tname_tnumber in self.test_result_dict):
                     self.test_result_dict[full_tname_tnumber] = [None] * self.site_count
+                    if self.numeric:
+                        self.test_flag_dict[full_tname_tnumber] = [TestResultBuilder.NO_TEST] * self.site_count
                 else:
                     pass
                     # if len(self.test_result_dict[full_tname_tnumber]) >= self.site_count:
                     #     # print('Duplicate test number found for test: ', tname_tnumber)
                     #     return
 
-                for j in range(self.site_count):
-                    if fields[V4.mpr.SITE_NUM] == self.test_result_dict['SITE_NUM'][j]:
-                        if fields[V4.mpr.TEST_FLG] == 0:
-                            mpr_result = str(tmp_RSLT_list[i])
-                        else:
-                            mpr_result = str(tmp_RSLT_list[i]) + '(F)'
-                        self.test_result_dict[full_tname_tnumber][j] = mpr_result
+                for j in self.site_slots.get(fields[V4.mpr.SITE_NUM], ()):
+                    if self.numeric:
+                        mpr_result = tmp_RSLT_list[i]
+                        self.test_flag_dict[full_tname_tnumber][j] = self.numeric_flag(fields[V4.mpr.TEST_FLG], mpr_result)
+                    elif fields[V4.mpr.TEST_FLG] == 0:
+                        mpr_result = str(tmp_RSLT_list[i])
+                    else:
+                        mpr_result = str(tmp_RSLT_list[i]) + '(F)'
+                    self.test_result_dict[full_tname_tnumber][j] = mpr_result
 
         # This is the functional test results
         if rectype == V4.ftr:
-            tname_tnumber = str(fields[V4.ftr.TEST_NUM]) + '|' + fields[V4.ftr.TEST_TXT] + '|-1|-1|' + \
-                            fields[V4.ftr.VECT_NAM]
+            tname_tnumber = self.catalog.names[self.catalog.ftr(fields)]
             if not (tname_tnumber in self.test_result_dict):
                 self.test_result_dict[tname_tnumber] = [None] * self.site_count
             else:
@@ -414,72 +679,73 @@ class MyTestResultProfiler:
                 # if len(self.test_result_dict[tname_tnumber]) >= self.site_count:
                 #     # print('Duplicate test number found for test: ', tname_tnumber)
                 #     return
-            for i in range(self.site_count):
-                if fields[V4.ftr.SITE_NUM] == self.test_result_dict['SITE_NUM'][i]:
-                    if fields[V4.ftr.TEST_FLG] == 0:
-                        ftr_result = '-1'
-                    else:
-                        ftr_result = '0(F)'
-                    self.test_result_dict[tname_tnumber][i] = ftr_result
+            for i in self.site_slots.get(fields[V4.ftr.SITE_NUM], ()):
+                if fields[V4.ftr.TEST_FLG] == 0:
+                    ftr_result = '-1'
+                else:
+                    ftr_result = '0(F)'
+                self.test_result_dict[tname_tnumber][i] = ftr_result
 
         if rectype == V4.eps:
             self.reset_flag = True
         if rectype == V4.prr:  # and fields[V4.prr.SITE_NUM]:
-            for i in range(self.site_count):
-                if fields[V4.prr.SITE_NUM] == self.test_result_dict['SITE_NUM'][i]:
-                    die_x = fields[V4.prr.X_COORD]
-                    die_y = fields[V4.prr.Y_COORD]
-                    part_id = fields[V4.prr.PART_ID]
-                    part_flg = fields[V4.prr.PART_FLG]
-                    h_bin = fields[V4.prr.HARD_BIN]
-                    s_bin = fields[V4.prr.SOFT_BIN]
-                    test_time = fields[V4.prr.TEST_T]
-                    # To judge the device is retested or not
-                    die_id = self.pgm_nam + '-' + self.job_nam + '-' + self.lot_id + '-' + str(
-                        self.wafer_id) + '-' + str(die_x) + '-' + str(die_y)
-                    if (part_flg & 0x1) ^ (part_flg & 0x2) == 1 or (die_id in self.DIE_ID):
-                        rc = 'Retest'
-                    else:
-                        rc = 'First'
-                    self.DIE_ID.append(die_id)
-
-                    self.test_result_dict['FILE_NAM'].append(self.file_nam)
-                    self.test_result_dict['TESTER_NAM'].append(self.tester_nam)
-                    self.test_result_dict['START_T'].append(self.start_t)
-                    self.test_result_dict['PGM_NAM'].append(self.pgm_nam)
-
-                    self.test_result_dict['JOB_NAM'].append(self.job_nam)
-                    self.test_result_dict['LOT_ID'].append(self.lot_id)
-                    self.test_result_dict['WAFER_ID'].append(self.wafer_id)
-
-                    self.test_result_dict['X_COORD'].append(die_x)
-                    self.test_result_dict['Y_COORD'].append(die_y)
-                    self.test_result_dict['PART_ID'].append(part_id)
-                    self.test_result_dict['RC'].append(rc)
-                    self.test_result_dict['HARD_BIN'].append(h_bin)
-                    self.test_result_dict['SOFT_BIN'].append(s_bin)
-                    self.test_result_dict['TEST_T'].append(test_time)
-
-            # Send current part result to all test result pd
+            for i in self.site_slots.get(fields[V4.prr.SITE_NUM], ()):
+                die_x = fields[V4.prr.X_COORD]
+                die_y = fields[V4.prr.Y_COORD]
+                part_id = fields[V4.prr.PART_ID]
+                part_flg = fields[V4.prr.PART_FLG]
+                h_bin = fields[V4.prr.HARD_BIN]
+                s_bin = fields[V4.prr.SOFT_BIN]
+                test_time = fields[V4.prr.TEST_T]
+                # To judge the device is retested or not, job, lot and wafer are fixed until the next WIR
+                die_id = (self.pgm_nam, die_x, die_y)
+                if (part_flg & 0x1) ^ (part_flg & 0x2) == 1 or (die_id in self.DIE_ID):
+                    rc = 'Retest'
+                else:
+                    rc = 'First'
+                self.DIE_ID.add(die_id)
+
+                self.test_result_dict['FILE_NAM'].append(self.file_nam)
+                self.test_result_dict['TESTER_NAM'].append(self.tester_nam)
+                self.test_result_dict['START_T'].append(self.start_t)
+                self.test_result_dict['PGM_NAM'].append(self.pgm_nam)
+
+                self.test_result_dict['JOB_NAM'].append(self.job_nam)
+                self.test_result_dict['LOT_ID'].append(self.lot_id)
+                self.test_result_dict['WAFER_ID'].append(self.wafer_id)
+
+                self.test_result_dict['X_COORD'].append(die_x)
+                self.test_result_dict['Y_COORD'].append(die_y)
+                self.test_result_dict['PART_ID'].append(part_id)
+                self.test_result_dict['RC'].append(rc)
+                self.test_result_dict['HARD_BIN'].append(h_bin)
+                self.test_result_dict['SOFT_BIN'].append(s_bin)
+                self.test_result_dict['TEST_T'].append(test_time)
+
+            # Send current part result to the result builder
             if fields[V4.prr.SITE_NUM] == self.test_result_dict['SITE_NUM'][-1]:
-                # tmp_pd = pd.DataFrame(self.test_result_dict)
-                tmp_pd = pd.DataFrame.from_dict(self.test_result_dict, orient='index').T
-                # tmp_pd.transpose()
-                self.all_test_result_pd = self.all_test_result_pd.append(tmp_pd, sort=False, ignore_index=True)
+                if self.writer is not None:
+                    self.writer.addTouchdown(self.test_result_dict, self.test_flag_dict)
+                else:
+                    self.results.addTouchdown(self.test_result_dict, self.test_flag_dict)
         if rectype == V4.sbr:
             sbin_num = fields[V4.sbr.SBIN_NUM]
             sbin_nam = fields[V4.sbr.SBIN_NAM]
             self.sbin_description[sbin_num] = str(sbin_nam) # str(sbin_num) + ' - ' + str(sbin_nam)
 
         self.lastrectype = rectype
-        self.notify_progress_bar.emit(int(self.file.tell()/self.filezise*100))
-        # print(int(self.file.tell()/self.filezise*100))
+        # Progress goes through a ProgressReporter sink instead of a file.tell() per record
 
     def after_complete(self, dataSource):
         start_t = time.time()
         # self.generate_bin_summary()
         # self.generate_wafer_map()
-        self.generate_data_summary()
+        if self.writer is not None:
+            self.writer.endFile(self.sbin_description)
+        else:
+            self.all_test_result_pd = self.results.frame()
+            self.flags = self.results.flagFrame()
+            self.generate_data_summary()
         end_t = time.time()
 
     def generate_data_summary(self):
@@ -521,17 +787,258 @@ class MyTestResultProfiler:
         else:
             print("No test result samples found :(")
 
+    @staticmethod
+    def merge_ranges(parsed):
+        """Yield (profiler, frame, flags) for each (FileRange, profiler) of one
+        file, taken in file order, with the columns and retests fixed up as if
+        the whole file had been profiled at once.  BIN_DESC is left to the
+        caller, the SBRs only come with the last range."""
+        full_names = {}
+        seen_dies = set()
+        for file_range, profiler in parsed:
+            # A test keeps the limits of its first appearance in the whole file
+            for tname_tnumber, full_tname_tnumber in profiler.tname_tnumber_dict.items():
+                full_names.setdefault(tname_tnumber, full_tname_tnumber)
+            frame = profiler.all_test_result_pd
+            if frame.empty:
+                yield profiler, frame, profiler.flags
+                continue
+            renames = dict((full_tname_tnumber, full_names[tname_tnumber])
+                           for tname_tnumber, full_tname_tnumber in profiler.tname_tnumber_dict.items())
+            frame = frame.rename(columns=renames)
+            die_ids = list(zip(frame.PGM_NAM, frame.X_COORD, frame.Y_COORD))
+            resets = [row for offset, row in profiler.wir_rows if offset >= file_range.start]
+            # Dies tested in earlier ranges are retests until the next WIR
+            first_reset = resets[0] if resets else len(die_ids)
+            retest = [die_id in seen_dies for die_id in die_ids[:first_reset]]
+            if any(retest):
+                frame.loc[frame.index[:first_reset][retest], 'RC'] = 'Retest'
+            if resets:
+                seen_dies = set(die_ids[resets[-1]:])
+            else:
+                seen_dies.update(die_ids)
+            yield profiler, frame, profiler.flags.rename(columns=renames)
+
+    @staticmethod
+    def merge(ranges, profilers):
+        """Merge the profilers of the FileRanges of one file, in file order,
+        into a single frame and flag frame as if the whole file had been
+        profiled at once"""
+        sbin_description = {}
+        frames = []
+        flags = []
+        for profiler, frame, frame_flags in MyTestResultProfiler.merge_ranges(zip(ranges, profilers)):
+            sbin_description.update(profiler.sbin_description)
+            if not frame.empty:
+                frames.append(frame)
+                flags.append(frame_flags)
+
+        if not frames:
+            return pd.DataFrame(), pd.DataFrame()
+        frame = pd.concat(frames, sort=False, ignore_index=True)
+        # Tests missing from a range come out of concat as NaN, the builder pads text with None
+        text = [name for name in frame.columns if frame[name].dtype == object]
+        frame[text] = frame[text].where(frame[text].notna(), None)
+        frame.BIN_DESC = frame.SOFT_BIN.replace(sbin_description)
+        flags = pd.concat(flags, sort=False, ignore_index=True).fillna(TestResultBuilder.NO_TEST)
+        return frame, flags.astype(np.uint8)
+
+    @staticmethod
+    def numeric_flag(test_flg, result):
+        flag = TestResultBuilder.FAIL if test_flg != 0 else 0
+        if result is None:
+            flag |= TestResultBuilder.NO_RESULT
+        return flag
+
+    @staticmethod
+    def render_result(value, flag):
+        # The text numeric=False stores for a result and its flags, None if there is no result
+        if flag & TestResultBuilder.NO_TEST:
+            return None
+        text = 'None' if flag & TestResultBuilder.NO_RESULT else str(value)
+        return text + '(F)' if flag & TestResultBuilder.FAIL else text
+
+    @staticmethod
+    def render_results(frame, flags):
+        """Return frame with the numeric result columns written out as text,
+        str(result) with '(F)' appended to failures, like numeric=False does"""
+        frame = frame.copy(deep=False)
+        render_result = MyTestResultProfiler.render_result
+        for name in flags.columns:
+            frame[name] = [render_result(value, flag)
+                           for value, flag in zip(frame[name].astype(np.float64).tolist(),
+                                                  flags[name].tolist())]
+        return frame
+
+
+class ScanFailLog:
+    # Columnar store for the scan fail log of My_STDF_V4_2007_1_Profiler. Fail
+    # cycles, pin indices and expected/captured states go into typed arrays,
+    # values repeated for every row of an STR are kept as (value, count) runs,
+    # and every part is stored once, rows referring to it by a PART run. Pin and
+    # pattern names are only looked up by index in frame() and writeParquet().
+    # Columns that come up short in a touchdown are padded with None, as the
+    # rows were lined up by position within the touchdown.
+    part_names = ['FILE_NAM', 'TESTER_NAM', 'START_T', 'PGM_NAM', 'JOB_NAM', 'LOT_ID', 'WAFER_ID',
+                  'SITE_NUM', 'X_COORD', 'Y_COORD', 'PART_ID']
+    run_names = ['PART', 'SITE_NUM', 'TEST_NAME', 'PSR_REF', 'FAIL_CNT', 'LOGGED_FAIL_CNT']
+    names = ['FILE_NAM', 'TESTER_NAM', 'START_T', 'PGM_NAM', 'JOB_NAM', 'LOT_ID', 'WAFER_ID',
+             'SITE_NUM', 'X_COORD', 'Y_COORD', 'PART_ID', 'TEST_NAME', 'PAT_NAME', 'MOD_NAME',
+             'FAIL_CNT', 'LOGGED_FAIL_CNT', 'FAIL_CYCLE', 'FAIL_PIN', 'EXP_DATA', 'CAP_DATA']
+    states = dict((number, chr(number)) for number in range(256))
+
+    def __init__(self):
+        self.parts = []
+        self.runs = dict((name, ([], [])) for name in self.run_names)
+        self.arrays = {'FAIL_CYCLE': array('Q'), 'FAIL_PIN': array('H'),
+                       'EXP_DATA': array('B'), 'CAP_DATA': array('B')}
+        self.lengths = dict.fromkeys(self.run_names + list(self.arrays), 0)
+        self.missing = {}    # array name -> [(start, count)] of padded rows
+        self.touchdowns = 0
+
+    def addRun(self, name, value, count):
+        if count > 0:
+            values, counts = self.runs[name]
+            values.append(value)
+            counts.append(count)
+            self.lengths[name] += count
+
+    def addPart(self, part, count):
+        # part holds the values of part_names, count is its number of rows
+        self.addRun('PART', len(self.parts), count)
+        self.parts.append(part)
+
+    def extend(self, name, values):
+        self.arrays[name].extend(values)
+        self.lengths[name] += len(values)
+
+    def addTouchdown(self, touchdown):
+        # touchdown is the ScanFailLog of one touchdown
+        rows = max(touchdown.lengths.values())
+        for name, (values, counts) in touchdown.runs.items():
+            if name == 'PART':
+                values = [value + len(self.parts) for value in values]
+            for value, count in zip(values, counts):
+                self.addRun(name, value, count)
+            self.addRun(name, None, rows - touchdown.lengths[name])
+        self.parts.extend(touchdown.parts)
+        for name, values in touchdown.arrays.items():
+            self.extend(name, values)
+            missing = rows - touchdown.lengths[name]
+            if missing > 0:
+                self.missing.setdefault(name, []).append((self.lengths[name], missing))
+                self.extend(name, bytes(missing))
+        self.touchdowns += 1
+
+    def values(self, name, dtype):
+        # Rows of a run column as a numpy array, and the mask of its padded rows
+        values, counts = self.runs[name]
+        mask = np.repeat(np.array([value is None for value in values], dtype=bool), counts)
+        values = np.array([0 if value is None else value for value in values], dtype=dtype)
+        return np.repeat(values, counts), mask
+
+    def codes(self, name, names=None):
+        # Rows of a column as codes into the list of its distinct values, looked
+        # up in names if given, returns the codes (-1 for padded rows) and the list
+        if name in self.arrays:
+            values, codes = np.unique(np.frombuffer(self.arrays[name], dtype=self.arrays[name].typecode),
+                                      return_inverse=True)
+            codes = codes.astype(np.int32)
+            for start, count in self.missing.get(name, ()):
+                codes[start:start + count] = -1
+            values = values.tolist()
+            if names is not None:
+                values = [names.get(value) for value in values]
+            return codes, values
+        values, counts = self.runs[name]
+        index = {}
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+            else:
+                if names is not None:
+                    value = names.get(value)
+                codes.append(index.setdefault(value, len(index)))
+        return np.repeat(np.array(codes, dtype=np.int32), counts), list(index)
+
+    def column(self, name, names=None):
+        codes, values = self.codes(name, names)
+        return np.array(values + [None], dtype=object)[codes]
+
+    def frame(self, pin_names, pat_names, mod_names):
+        # pin_names maps PMR indices, pat_names and mod_names PSR indices to names
+        if not self.touchdowns:
+            return pd.DataFrame()
+        part, padded = self.values('PART', np.int64)
+        part[padded] = -1
+        data = {}
+        for position, name in enumerate(self.part_names):
+            data[name] = np.array([values[position] for values in self.parts] + [None], dtype=object)[part]
+        data['SITE_NUM'] = self.column('SITE_NUM')
+        data['TEST_NAME'] = self.column('TEST_NAME')
+        data['PAT_NAME'] = self.column('PSR_REF', pat_names)
+        data['MOD_NAME'] = self.column('PSR_REF', mod_names)
+        data['FAIL_CNT'] = self.column('FAIL_CNT')
+        data['LOGGED_FAIL_CNT'] = self.column('LOGGED_FAIL_CNT')
+        data['FAIL_CYCLE'] = np.frombuffer(self.arrays['FAIL_CYCLE'], dtype=np.uint64)
+        if 'FAIL_CYCLE' in self.missing:
+            data['FAIL_CYCLE'] = data['FAIL_CYCLE'].astype(object)
+            for start, count in self.missing['FAIL_CYCLE']:
+                data['FAIL_CYCLE'][start:start + count] = None
+        data['FAIL_PIN'] = self.column('FAIL_PIN', pin_names)
+        data['EXP_DATA'] = self.column('EXP_DATA', self.states)
+        data['CAP_DATA'] = self.column('CAP_DATA', self.states)
+        return pd.DataFrame(data, columns=self.names)
+
+    def writeParquet(self, directory, pin_names, pat_names, mod_names):
+        # Writes parts.parquet with one row per part and fails.parquet with one
+        # row per fail cycle, referring to its part by PART. Names are stored as
+        # dictionary columns. Needs pyarrow.
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        def dictionary(codes, values):
+            # Unknown names are stored as null rows, parquet can't take them in the dictionary
+            unknown = np.array([value is None for value in values] + [True], dtype=bool)
+            values = ['' if value is None else str(value) for value in values]
+            return pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32(), mask=unknown[codes]),
+                                                  pa.array(values, pa.string()))
+
+        def numbers(name, dtype):
+            values, mask = self.values(name, dtype)
+            return pa.array(values, mask=mask)
+
+        os.makedirs(directory, exist_ok=True)
+        parts = dict((name, [values[position] for values in self.parts])
+                     for position, name in enumerate(self.part_names))
+        part_types = {'SITE_NUM': pa.uint8(), 'X_COORD': pa.int16(), 'Y_COORD': pa.int16()}
+        columns = [pa.array(np.arange(len(self.parts), dtype=np.uint32))]
+        columns += [pa.array(parts[name], part_types.get(name, pa.string())) for name in self.part_names]
+        pq.write_table(pa.Table.from_arrays(columns, ['PART'] + self.part_names),
+                       os.path.join(directory, 'parts.parquet'))
+
+        fail_cycle = np.frombuffer(self.arrays['FAIL_CYCLE'], dtype=np.uint64)
+        mask = np.zeros(len(fail_cycle), dtype=bool)
+        for start, count in self.missing.get('FAIL_CYCLE', ()):
+            mask[start:start + count] = True
+        columns = [numbers('PART', np.uint32), numbers('SITE_NUM', np.uint8),
+                   dictionary(*self.codes('TEST_NAME')),
+                   dictionary(*self.codes('PSR_REF', pat_names)), dictionary(*self.codes('PSR_REF', mod_names)),
+                   numbers('FAIL_CNT', np.uint32), numbers('LOGGED_FAIL_CNT', np.uint32),
+                   pa.array(fail_cycle, mask=mask),
+                   dictionary(*self.codes('FAIL_PIN', pin_names)),
+                   dictionary(*self.codes('EXP_DATA', self.states)),
+                   dictionary(*self.codes('CAP_DATA', self.states))]
+        names = ['PART', 'SITE_NUM', 'TEST_NAME', 'PAT_NAME', 'MOD_NAME', 'FAIL_CNT', 'LOGGED_FAIL_CNT',
+                 'FAIL_CYCLE', 'FAIL_PIN', 'EXP_DATA', 'CAP_DATA']
+        pq.write_table(pa.Table.from_arrays(columns, names), os.path.join(directory, 'fails.parquet'))
+        return directory
+
 
 # Get STR, PSR data from STDF V4-2007.1
 class My_STDF_V4_2007_1_Profiler:
     def __init__(self, filename):
-        self.reset_flag = False
-        self.lastrectype = None
-        self.is_V4_2007_1 = False
-        self.pmr_dict = {}
-        self.pat_name = ''
-        self.mod_name = ''
-
         self.file_nam = filename.split('/')[-1]
         self.tester_nam = ''
         self.start_t = ''
@@ -539,20 +1046,7 @@ class My_STDF_V4_2007_1_Profiler:
         self.lot_id = ''
         self.wafer_id = ''
         self.job_nam = ''
-
-        self.cont_flag = 0
-        self.test_result_dict = {'FILE_NAM': [], 'TESTER_NAM': [], 'START_T': [], 'PGM_NAM': [],
-                                 'JOB_NAM': [], 'LOT_ID': [], 'WAFER_ID': [], 'SITE_NUM': [],
-                                 'X_COORD': [], 'Y_COORD': [], 'PART_ID': [], 'TEST_NAME': [],
-                                 'PAT_NAME': [], 'MOD_NAME': [], 'FAIL_COUNT': [], 'FAIL_CYCLE': [],
-                                 'FAIL_PIN': [], 'EXP_DATA': [], 'CAP_DATA': []}
-        self.cyc_ofst = []
-        self.fail_pin = []
-        self.exp_data = []
-        self.cap_data = []
-        self.all_test_result_pd = pd.DataFrame()
-        self.total_logged_count = 0
-        self.row_cnt = 0
+        self.after_begin(None)
 
     def after_begin(self, dataSource):
         self.reset_flag = False
@@ -562,19 +1056,19 @@ class My_STDF_V4_2007_1_Profiler:
         self.pat_nam_dict = {}
         self.mod_nam_dict = {}
         self.cont_flag = 0
-        self.test_result_dict = {'FILE_NAM': [], 'TESTER_NAM': [], 'START_T': [], 'PGM_NAM': [],
-                                 'JOB_NAM': [], 'LOT_ID': [], 'WAFER_ID': [], 'SITE_NUM': [],
-                                 'X_COORD': [], 'Y_COORD': [], 'PART_ID': [], 'TEST_NAME': [],
-                                 'PAT_NAME': [], 'MOD_NAME': [], 'FAIL_COUNT': [], 'FAIL_CYCLE': [],
-                                 'FAIL_PIN': [], 'EXP_DATA': [], 'CAP_DATA': []}
-
-        self.cyc_ofst = []
-        self.fail_pin = []
-        self.exp_data = []
-        self.cap_data = []
+        self.site_count = 0
+        self.site_array = []
+        self.site_slots = {}
+        self.row_cnt = []
+        self.fail_log = ScanFailLog()
+        self.touchdown = ScanFailLog()
+        # Fail data of the STRs continued so far
+        self.cyc_ofst = array('Q')
+        self.fail_pin = array('H')
+        self.exp_data = array('B')
+        self.cap_data = array('B')
         self.all_test_result_pd = pd.DataFrame()
         self.total_logged_count = 0
-        self.row_cnt = 0
 
     def after_send(self, dataSource, data):
         rectype, fields = data
@@ -596,87 +1090,65 @@ class My_STDF_V4_2007_1_Profiler:
                 self.reset_flag = False
                 self.site_count = 0
                 self.site_array = []
+                self.site_slots = {}
                 self.row_cnt = []
-                self.test_result_dict = {'FILE_NAM': [], 'TESTER_NAM': [], 'START_T': [], 'PGM_NAM': [],
-                                         'JOB_NAM': [], 'LOT_ID': [], 'WAFER_ID': [], 'SITE_NUM': [],
-                                         'X_COORD': [], 'Y_COORD': [], 'PART_ID': [], 'TEST_NAME': [],
-                                         'PAT_NAME': [], 'MOD_NAME': [], 'FAIL_CNT': [], 'LOGGED_FAIL_CNT': [],
-                                         'FAIL_CYCLE': [], 'FAIL_PIN': [], 'EXP_DATA': [], 'CAP_DATA': []}
+                self.touchdown = ScanFailLog()
 
+            self.site_slots.setdefault(fields[V4.pir.SITE_NUM], []).append(self.site_count)
             self.site_count += 1
             self.site_array.append(fields[V4.pir.SITE_NUM])
-            # self.test_result_dict['SITE_NUM'] = self.site_array
             self.row_cnt.append(0)
 
         if rectype == V4.vur and fields[V4.vur.UPD_NAM] == 'Scan:2007.1':
             self.is_V4_2007_1 = True
         if rectype == V4.pmr:
-            self.pmr_dict[str(fields[V4.pmr.PMR_INDX])] = str(fields[V4.pmr.LOG_NAM])
+            self.pmr_dict[fields[V4.pmr.PMR_INDX]] = str(fields[V4.pmr.LOG_NAM])
         if rectype == V4.psr:
             psr_nam = str(fields[V4.psr.PSR_NAM])
-            self.pat_nam_dict[str(fields[V4.psr.PSR_INDX])] = psr_nam.split(':')[0]
-            self.mod_nam_dict[str(fields[V4.psr.PSR_INDX])] = psr_nam.split(':')[1]
+            self.pat_nam_dict[fields[V4.psr.PSR_INDX]] = psr_nam.split(':')[0]
+            self.mod_nam_dict[fields[V4.psr.PSR_INDX]] = psr_nam.split(':')[1]
         if rectype == V4.str:
-            for i in range(self.site_count):
-                if fields[V4.str.SITE_NUM] == self.site_array[i]:
-                    self.cont_flag = fields[V4.str.CONT_FLG]
-                    self.cyc_ofst = self.cyc_ofst + fields[V4.str.CYC_OFST]
-                    self.fail_pin = self.fail_pin + [self.pmr_dict[str(number)] for number in fields[V4.str.PMR_INDX]] # fields[V4.str.PMR_INDX]
-                    self.exp_data = self.exp_data + [chr(number) for number in fields[V4.str.EXP_DATA]] # fields[V4.str.EXP_DATA]
-                    self.cap_data = self.cap_data + [chr(number) for number in fields[V4.str.CAP_DATA]] # fields[V4.str.CAP_DATA]
-
-                    if self.cont_flag == 0:
-                        self.total_logged_count = fields[V4.str.TOTL_CNT]
-                        self.row_cnt[i] = self.row_cnt[i] + self.total_logged_count
-
-                        self.test_result_dict['SITE_NUM'] = self.test_result_dict['SITE_NUM'] + [fields[V4.str.SITE_NUM]] * self.total_logged_count
-                        self.test_result_dict['FAIL_CNT'] = self.test_result_dict['FAIL_CNT'] + [fields[V4.str.TOTF_CNT]] * self.total_logged_count
-                        self.test_result_dict['LOGGED_FAIL_CNT'] = self.test_result_dict['LOGGED_FAIL_CNT'] + [fields[V4.str.TOTL_CNT]] * self.total_logged_count
-                        self.test_result_dict['TEST_NAME'] = self.test_result_dict['TEST_NAME'] + [fields[V4.str.TEST_TXT]] * self.total_logged_count
-                        self.test_result_dict['PAT_NAME'] = self.test_result_dict['PAT_NAME'] + [self.pat_nam_dict[str(fields[V4.str.PSR_REF])]] * self.total_logged_count
-                        self.test_result_dict['MOD_NAME'] = self.test_result_dict['MOD_NAME'] + [self.mod_nam_dict[str(fields[V4.str.PSR_REF])]] * self.total_logged_count
-
-                        self.test_result_dict['FAIL_CYCLE'] = self.test_result_dict['FAIL_CYCLE'] + self.cyc_ofst
-                        self.test_result_dict['FAIL_PIN'] = self.test_result_dict['FAIL_PIN'] + self.fail_pin
-                        self.test_result_dict['EXP_DATA'] = self.test_result_dict['EXP_DATA'] + self.exp_data
-                        self.test_result_dict['CAP_DATA'] = self.test_result_dict['CAP_DATA'] + self.cap_data
-                        # Reset
-                        self.cyc_ofst = []
-                        self.fail_pin = []
-                        self.exp_data = []
-                        self.cap_data = []
-                        pass
-                    else:
-                        pass
+            for i in self.site_slots.get(fields[V4.str.SITE_NUM], ()):
+                self.cont_flag = fields[V4.str.CONT_FLG]
+                self.cyc_ofst.extend(fields[V4.str.CYC_OFST])
+                self.fail_pin.extend(fields[V4.str.PMR_INDX])
+                self.exp_data.extend(fields[V4.str.EXP_DATA])
+                self.cap_data.extend(fields[V4.str.CAP_DATA])
+
+                if self.cont_flag == 0:
+                    self.total_logged_count = fields[V4.str.TOTL_CNT]
+                    self.row_cnt[i] = self.row_cnt[i] + self.total_logged_count
+
+                    touchdown = self.touchdown
+                    touchdown.addRun('SITE_NUM', fields[V4.str.SITE_NUM], self.total_logged_count)
+                    touchdown.addRun('FAIL_CNT', fields[V4.str.TOTF_CNT], self.total_logged_count)
+                    touchdown.addRun('LOGGED_FAIL_CNT', fields[V4.str.TOTL_CNT], self.total_logged_count)
+                    touchdown.addRun('TEST_NAME', fields[V4.str.TEST_TXT], self.total_logged_count)
+                    touchdown.addRun('PSR_REF', fields[V4.str.PSR_REF], self.total_logged_count)
+
+                    touchdown.extend('FAIL_CYCLE', self.cyc_ofst)
+                    touchdown.extend('FAIL_PIN', self.fail_pin)
+                    touchdown.extend('EXP_DATA', self.exp_data)
+                    touchdown.extend('CAP_DATA', self.cap_data)
+                    # Reset
+                    self.cyc_ofst = array('Q')
+                    self.fail_pin = array('H')
+                    self.exp_data = array('B')
+                    self.cap_data = array('B')
 
         if rectype == V4.eps:
             self.reset_flag = True
         if rectype == V4.prr:  # and fields[V4.prr.SITE_NUM]:
-            for i in range(self.site_count):
-                if fields[V4.prr.SITE_NUM] == self.site_array[i]:
-                    die_x = fields[V4.prr.X_COORD]
-                    die_y = fields[V4.prr.Y_COORD]
-                    part_id = fields[V4.prr.PART_ID]
-
-                    self.test_result_dict['FILE_NAM'] += [self.file_nam] * self.row_cnt[i]
-                    self.test_result_dict['TESTER_NAM'] += [self.tester_nam] * self.row_cnt[i]
-                    self.test_result_dict['START_T'] += [self.start_t] * self.row_cnt[i]
-                    self.test_result_dict['PGM_NAM'] += [self.pgm_nam] * self.row_cnt[i]
-
-                    self.test_result_dict['JOB_NAM'] += [self.job_nam] * self.row_cnt[i]
-                    self.test_result_dict['LOT_ID'] += [self.lot_id] * self.row_cnt[i]
-                    self.test_result_dict['WAFER_ID'] += [self.wafer_id] * self.row_cnt[i]
-
-                    self.test_result_dict['X_COORD'] += [die_x] * self.row_cnt[i]
-                    self.test_result_dict['Y_COORD'] += [die_y] * self.row_cnt[i]
-                    self.test_result_dict['PART_ID'] += [part_id] * self.row_cnt[i]
-            # Send current part result to all test result pd
+            for i in self.site_slots.get(fields[V4.prr.SITE_NUM], ()):
+                self.touchdown.addPart((self.file_nam, self.tester_nam, self.start_t, self.pgm_nam, self.job_nam,
+                                        self.lot_id, self.wafer_id, fields[V4.prr.SITE_NUM],
+                                        fields[V4.prr.X_COORD], fields[V4.prr.Y_COORD],
+                                        fields[V4.prr.PART_ID]), self.row_cnt[i])
+            # Send current touchdown to the fail log
             if fields[V4.prr.SITE_NUM] == self.site_array[-1]:
-                # tmp_pd = pd.DataFrame(self.test_result_dict)
-                tmp_pd = pd.DataFrame.from_dict(self.test_result_dict, orient='index').T
-                # tmp_pd.transpose()
-                self.all_test_result_pd = self.all_test_result_pd.append(tmp_pd, sort=False, ignore_index=True)
+                self.fail_log.addTouchdown(self.touchdown)
+                self.touchdown = ScanFailLog()
         self.lastrectype = rectype
 
     def after_complete(self, dataSource):
-        pass
+        self.all_test_result_pd = self.fail_log.frame(self.pmr_dict, self.pat_nam_dict, self.mod_nam_dict)